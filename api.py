@@ -0,0 +1,163 @@
+# api.py
+"""
+Headless recommendation API next to the Streamlit UI, built on the same services.
+
+    uvicorn api:app --host 0.0.0.0 --port 8000 --workers 4
+
+POST /recommend   {"text": "...", "user_id": 1}  ->  {"mood": "...", "song": {...}}
+POST /rank        {"text": "...", "k": 10, "diversity": 0.3}  ->  {"songs": [...]}
+GET  /history/{user_id}                          ->  {"history": [...]}  (503 if storage fails)
+"""
+
+import asyncio
+import contextlib
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, PlainTextResponse
+from starlette.routing import Route
+
+import resources
+
+resources.load_environment()
+
+import metrics
+from emotion_analyzer import analyze_emotion, keyword_emotion
+from song_ranker import get_ranked_songs, query_vector
+from song_recommender import get_song_recommender
+from storage import StorageError
+from user_logger import interaction_writer, log_user_interaction, read_user_history
+
+# Processes for the CPU-heavy stages, the TextBlob polarity fallback and the
+# /rank query vector (0 runs them on the I/O threads instead). Keyword matches
+# are answered inline.
+API_ANALYSIS_PROCESSES = int(os.environ.get("API_ANALYSIS_PROCESSES", min(4, os.cpu_count() or 1)))
+# Threads for storage calls: catalog loads, history reads and anything else that blocks.
+API_IO_THREADS = int(os.environ.get("API_IO_THREADS", 32))
+API_MAX_TEXT_LENGTH = int(os.environ.get("API_MAX_TEXT_LENGTH", 5000))
+API_MAX_RANKED_SONGS = int(os.environ.get("API_MAX_RANKED_SONGS", 100))
+
+_executors = {}
+
+
+def _error(message: str, status_code: int = 400) -> JSONResponse:
+    return JSONResponse({"error": message}, status_code=status_code)
+
+
+def _parse_user_id(value):
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, str)) or not str(value).isdigit() or int(value) <= 0:
+        raise ValueError("user_id must be a positive integer.")
+    return int(value)
+
+
+async def _analyze(text: str) -> str:
+    emotion = keyword_emotion(text)
+    if emotion:
+        return emotion
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executors['analysis'], analyze_emotion, text)
+
+
+async def _read_text_body(request):
+    # Returns (body, text, None) for a valid body, or (None, None, error response).
+    try:
+        body = await request.json()
+    except ValueError:
+        return None, None, _error("Request body must be JSON.")
+    if not isinstance(body, dict):
+        return None, None, _error("Request body must be a JSON object.")
+    text = body.get("text")
+    if not isinstance(text, str) or not text.strip():
+        return None, None, _error("'text' must be a non-empty string.")
+    if len(text) > API_MAX_TEXT_LENGTH:
+        return None, None, _error(f"'text' must be at most {API_MAX_TEXT_LENGTH} characters.")
+    return body, text, None
+
+
+async def recommend(request):
+    body, text, error = await _read_text_body(request)
+    if error:
+        return error
+    try:
+        user_id = _parse_user_id(body.get("user_id"))
+    except ValueError as e:
+        return _error(str(e))
+
+    with metrics.timed('api.recommend'):
+        mood = await _analyze(text)
+        loop = asyncio.get_running_loop()
+        song = await loop.run_in_executor(_executors['io'], get_song_recommender, mood, user_id)
+        if song and user_id is not None:
+            # Only queues the record; the batched writer does the insert.
+            log_user_interaction(user_id, text, mood, song['id'], song)
+    return JSONResponse({"mood": mood, "song": song})
+
+
+async def rank(request):
+    body, text, error = await _read_text_body(request)
+    if error:
+        return error
+    k, diversity = body.get("k", 10), body.get("diversity", 0.0)
+    if isinstance(k, bool) or not isinstance(k, int) or not 1 <= k <= API_MAX_RANKED_SONGS:
+        return _error(f"'k' must be an integer from 1 to {API_MAX_RANKED_SONGS}.")
+    if isinstance(diversity, bool) or not isinstance(diversity, (int, float)) or not 0 <= diversity <= 1:
+        return _error("'diversity' must be a number from 0 to 1.")
+    with metrics.timed('api.rank'):
+        loop = asyncio.get_running_loop()
+        # The query vector may need the polarity fallback, so it is computed with
+        # the analysis processes; only the catalog lookups run on the I/O threads.
+        query = await loop.run_in_executor(_executors['analysis'], query_vector, text)
+        songs = await loop.run_in_executor(_executors['io'], get_ranked_songs, text, k, float(diversity), (), query)
+    return JSONResponse({"songs": songs})
+
+
+async def history(request):
+    try:
+        user_id = _parse_user_id(request.path_params["user_id"])
+    except ValueError as e:
+        return _error(str(e))
+    with metrics.timed('api.history'):
+        loop = asyncio.get_running_loop()
+        try:
+            rows = await loop.run_in_executor(_executors['io'], read_user_history, user_id)
+        except StorageError as e:
+            print(f"Error fetching history: {e}")
+            return _error("History is unavailable right now. Please try again later.", 503)
+    return JSONResponse({"history": rows})
+
+
+async def prometheus(request):
+    return PlainTextResponse(metrics.render_prometheus())
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    resources.warm_up_configured(background=False)
+    _executors['io'] = ThreadPoolExecutor(max_workers=API_IO_THREADS, thread_name_prefix='api-io')
+    if API_ANALYSIS_PROCESSES > 0:
+        # spawn, not fork: the parent already runs threads (writer, catalog refresh).
+        _executors['analysis'] = ProcessPoolExecutor(max_workers=API_ANALYSIS_PROCESSES,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+    else:
+        _executors['analysis'] = _executors['io']
+    try:
+        yield
+    finally:
+        _executors['analysis'].shutdown(wait=True)
+        _executors['io'].shutdown(wait=True)
+        interaction_writer.close()
+
+
+app = Starlette(
+    routes=[
+        Route('/recommend', recommend, methods=['POST']),
+        Route('/rank', rank, methods=['POST']),
+        Route('/history/{user_id}', history, methods=['GET']),
+        Route('/metrics', prometheus, methods=['GET']),
+    ],
+    lifespan=lifespan,
+)
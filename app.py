@@ -1,21 +1,25 @@
 import streamlit as st
-from supabase import create_client, Client
-from dotenv import load_dotenv
 import os
-import getpass 
+
+import resources
+
+# Settings are read at import time by the service modules, so .env goes first.
+resources.load_environment()
+
+import metrics
 
 from auth_service import create_user, sign_in_user 
 from emotion_analyzer import analyze_emotion
 from song_recommender import get_song_recommender
-from user_logger import log_user_interaction, get_user_history 
+from user_logger import log_user_interaction, get_user_history, invalidate_user_history 
 
 st.set_page_config(page_title="Mood AI Recommender", layout="wide", initial_sidebar_state="collapsed")
 
-# Load environment variables and Supabase client
-load_dotenv()
-supabase_url = os.environ.get("SUPABASE_URL")
-supabase_key = os.environ.get("SUPABASE_KEY")
-supabase: Client = create_client(supabase_url, supabase_key)
+# Start the Prometheus exporters configured by METRICS_PORT / METRICS_FILE (once per process)
+metrics.start_exporters()
+# Build the resources listed in WARM_UP_RESOURCES in the background (once per process)
+resources.warm_up_configured()
+SHOW_METRICS_PANEL = os.environ.get("SHOW_METRICS_PANEL", "").lower() in ("1", "true", "yes")
 
 # --- CUSTOM CSS INJECTION FOR MINIMALIST DARK MODE ---
 st.markdown("""
@@ -84,7 +88,6 @@ if 'user_id' not in st.session_state: st.session_state['user_id'] = None
 if 'user_name' not in st.session_state: st.session_state['user_name'] = None 
 if 'page' not in st.session_state: st.session_state['page'] = 'home' 
 if 'last_input' not in st.session_state: st.session_state['last_input'] = ""
-if 'is_analyzing' not in st.session_state: st.session_state['is_analyzing'] = False
 
 
 # --- AUTHENTICATION FORMS ---
@@ -106,6 +109,8 @@ def show_login_page():
                 with st.spinner("Verifying credentials..."):
                     user_id, user_name = sign_in_user(email, password)
                     if user_id:
+                        # A new session starts from the stored history, not a stale copy.
+                        invalidate_user_history(user_id)
                         st.session_state['logged_in'] = True
                         st.session_state['user_id'] = user_id
                         st.session_state['user_name'] = user_name 
@@ -254,8 +259,11 @@ def show_main_app():
     show_input_and_results(True)
 
 
+@st.fragment
 def show_input_and_results(is_logged_in):
     # Renders the core functionality (Input Box and Recommendation Logic)
+    # As a fragment, a click here reruns only this panel: the header, CSS and
+    # history expander are not re-executed, and the analysis runs in the same pass.
     
     # Use columns to place the text area and the button on the same line
     input_col, button_col = st.columns([0.8, 0.2]) # 80% width for text, 20% for button
@@ -270,27 +278,23 @@ def show_input_and_results(is_logged_in):
         st.markdown('<div style="height: 60px;"></div>', unsafe_allow_html=True) 
         
         # The button is now placed directly beside the text area
-        if st.button("Analyze & Get Song", type="primary", use_container_width=True, key="analyze_button_main"):
-            if user_input:
-                st.session_state['last_input'] = user_input
-                st.session_state['is_analyzing'] = True
-                st.rerun()
-            else:
-                st.warning("Please enter some text for mood analysis.")
+        analyze_clicked = st.button("Analyze & Get Song", type="primary", use_container_width=True, key="analyze_button_main")
+        if analyze_clicked and not user_input:
+            st.warning("Please enter some text for mood analysis.")
                 
-    # Display Results after a Rerun (This section remains unchanged)
-    if st.session_state.get('is_analyzing'):
-        st.session_state['is_analyzing'] = False 
+    # Display Results in the same run as the click
+    if analyze_clicked and user_input:
+        st.session_state['last_input'] = user_input
         
         with st.spinner("Analyzing emotional tone..."):
-            detected_mood = analyze_emotion(st.session_state['last_input'])
+            detected_mood = analyze_emotion(user_input)
             st.session_state['last_mood'] = detected_mood
             
             st.markdown("---")
             st.subheader("✅ Analysis Result")
             st.success(f"The detected emotional tone is: **{detected_mood.upper()}**.")
 
-            song = get_song_recommender(detected_mood)
+            song = get_song_recommender(detected_mood, st.session_state['user_id'] if is_logged_in else None)
 
             if song:
                 st.info("✨ Your Song Recommendation:")
@@ -305,14 +309,29 @@ def show_input_and_results(is_logged_in):
                 # Log the interaction only if logged in
                 if is_logged_in:
                     try:
-                        log_user_interaction(st.session_state['user_id'], st.session_state['last_input'], detected_mood, song['id'])
-                        st.caption("Interaction logged successfully and saved to history.")
+                        if log_user_interaction(st.session_state['user_id'], user_input, detected_mood, song['id'], song):
+                            st.caption("Interaction logged successfully and saved to history.")
+                        else:
+                            st.caption("The logging queue is full; this interaction was not saved.")
                     except Exception as e:
                         st.caption(f"Error logging interaction: {e}")
                 else:
                     st.caption("Log in to save this recommendation to your history!")
             else:
                 st.warning(f"No songs found for mood: {detected_mood.upper()}. Please add more songs to your database.")
+# --- ADMIN METRICS ---
+
+def show_metrics_panel():
+    # Per-stage latency recorded by metrics.timed, for operators only (SHOW_METRICS_PANEL=1).
+    st.markdown("---")
+    with st.expander("📊 Stage Latency (admin)", expanded=False):
+        rows = metrics.summary()
+        if rows:
+            st.dataframe(rows, use_container_width=True)
+        else:
+            st.info("No stages have been recorded yet.")
+
+
 # --- MAIN ENTRY POINT ---
 
 def main_page():
@@ -329,5 +348,8 @@ def main_page():
     elif st.session_state['page'] == 'home' and not st.session_state['logged_in']:
         show_welcome_page() # Initial, unauthenticated view
 
+    if SHOW_METRICS_PANEL:
+        show_metrics_panel()
+
 if __name__ == '__main__':
     main_page()
\ No newline at end of file
@@ -1,10 +1,11 @@
 # auth_service.py
 import os
-import bcrypt
 import streamlit as st 
-from supabase_client import supabase
-from postgrest.exceptions import APIError
+from storage import get_storage, StorageError
+from password_hasher import password_hasher, HasherBusyError
+from metrics import timed
 
+@timed('auth.sign_up')
 def create_user(name, age, email, password):
     """
     Creates a new user, securely hashing the password before storing it.
@@ -12,16 +13,14 @@ def create_user(name, age, email, password):
     """
     try:
         # 1. Check if user already exists
-        response = supabase.table('users').select('id').eq('email', email).limit(1).execute()
-        if response.data:
+        if get_storage().find_user_by_email(email):
             st.error("Sign-up Error: A user with this email already exists.")
             return None, None
         
-        # 2. Hash the password securely with bcrypt
-        hashed_bytes = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
-        password_hash = hashed_bytes.decode('utf-8')
+        # 2. Hash the password securely with bcrypt (on the shared hashing pool)
+        password_hash = password_hasher.hash(password)
 
-        # 3. Insert user into Supabase
+        # 3. Insert user into the configured storage backend
         data = {
             "name": name,
             "age": age,
@@ -29,41 +28,60 @@ def create_user(name, age, email, password):
             "username": email.split('@')[0],
             "password_hash": password_hash
         }
-        user_data = supabase.table('users').insert(data).execute().data[0]
+        user_data = get_storage().create_user(data)
         return user_data['id'], user_data['name'] # Return both ID and Name
-    except APIError:
+    except StorageError:
         st.error(f"Sign-up Error: API failed to create user.")
         return None, None
+    except HasherBusyError as e:
+        st.error(f"Sign-up Error: {e}")
+        return None, None
     except Exception as e:
         st.error(f"Sign-up Error: An unexpected error occurred. {e}")
         return None, None
 
+def _rehash_password(user_id, password):
+    """
+    Stores a new hash of the password made with the configured bcrypt cost.
+    A failure here must not fail the login, so it is only reported.
+    """
+    try:
+        get_storage().update_password_hash(user_id, password_hasher.hash(password))
+    except Exception as e:
+        print(f"Could not upgrade the password hash for user {user_id}: {e}")
+
+@timed('auth.sign_in')
 def sign_in_user(email, password):
     """
-    Signs in a user by securely verifying the password hash against Supabase.
+    Signs in a user by securely verifying the password hash against the stored one.
     Returns the user's integer ID and Name on successful login.
     """
     try:
         # 1. Retrieve the stored hash, ID, and NAME
-        response = supabase.table('users').select('id, name, password_hash').eq('email', email).limit(1).execute()
+        user = get_storage().find_user_by_email(email)
         
-        if not response.data:
+        if not user:
             return None, None # User not found
             
-        user = response.data[0]
-        stored_hash = user['password_hash'].encode('utf-8')
+        stored_hash = user['password_hash']
         
-        # 2. Verify the password using bcrypt.checkpw
-        if bcrypt.checkpw(password.encode('utf-8'), stored_hash):
+        # 2. Verify the password using bcrypt.checkpw (on the shared hashing pool)
+        if password_hasher.verify(password, stored_hash):
+            # 3. Upgrade hashes made with an older cost factor while we have the password
+            if password_hasher.needs_rehash(stored_hash):
+                _rehash_password(user['id'], password)
             return user['id'], user['name'] # Login successful, return ID and Name
         else:
             # Note: Do not reveal whether it's the email or password that is wrong
             st.error("Login failed. Invalid email or password.")
             return None, None 
             
-    except APIError:
+    except StorageError:
         st.error(f"Login Error: API failed to retrieve user.")
         return None, None
+    except HasherBusyError as e:
+        st.error(f"Login Error: {e}")
+        return None, None
     except Exception as e:
         st.error(f"Login Error: An unexpected error occurred. {e}")
         return None, None
\ No newline at end of file
@@ -0,0 +1,344 @@
+# benchmark.py
+"""
+Microbenchmarks for the hot paths of the recommendation pipeline.
+
+Runs against an in-memory storage backend, so no Supabase project is needed:
+
+    python benchmark.py --output bench.json
+    python benchmark.py --output new.json --compare bench.json --threshold 0.10
+
+With --compare, any benchmark whose median got slower by more than the
+threshold is reported and the command exits with status 1.
+
+The startup suite times fresh interpreters importing app.py and rendering its
+first page, and also exits with status 1 when a median exceeds its budget:
+
+    python benchmark.py --suite startup --budget startup.first_render=1500
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+from storage import InMemoryBackend, set_storage
+
+MOODS = ('happy', 'calm', 'sad', 'angry', 'neutral', 'fear', 'surprise')
+CATALOG_SIZES = (1_000, 100_000, 1_000_000)
+CORPUS_SIZE = 200
+SEED = 1234
+# Default startup budgets in milliseconds (median over fresh processes).
+STARTUP_BUDGETS_MS = {
+    'startup.import_app': 1500,
+    'startup.first_render': 2500,
+}
+STARTUP_RUNS = 5
+
+_FILLER = ("today work the morning we went out after a long week and then nothing much happened "
+           "my friend called about dinner plans while the weather stayed grey").split()
+_KEYWORDS = ['angry', 'furious', 'calm', 'relaxed', 'scared', 'anxious', 'shocked', 'amazed', 'frustrated']
+_POLAR = ['happy', 'great', 'wonderful', 'sad', 'terrible', 'awful', 'fine', 'okay']
+
+
+def build_corpora(size: int = CORPUS_SIZE) -> dict:
+    """
+    Builds the fixed input corpora. The same seed always yields the same texts,
+    so results stay comparable across commits.
+    """
+    rng = random.Random(SEED)
+
+    def sentence(length, extra=(), extra_every=0):
+        words = [rng.choice(_FILLER) for _ in range(length)]
+        if extra_every:
+            for i in range(0, length, extra_every):
+                words[i] = rng.choice(extra)
+        return ' '.join(words)
+
+    return {
+        'short': [sentence(6, _POLAR, 3) for _ in range(size)],
+        'long': [sentence(400, _POLAR, 40) for _ in range(size)],
+        'keyword_heavy': [sentence(60, _KEYWORDS, 4) for _ in range(size)],
+        'keyword_free': [sentence(60) for _ in range(size)],
+    }
+
+
+def measure(fn, rounds: int = 7, min_time: float = 0.05) -> dict:
+    """
+    Times fn() and returns per-call statistics in microseconds. The number of
+    calls per round is calibrated so a round takes at least `min_time` seconds.
+    """
+    calls = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(calls):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or calls >= 1_000_000:
+            break
+        calls *= 10 if elapsed < min_time / 10 else 2
+    samples = [elapsed / calls]
+    for _ in range(rounds - 1):
+        start = time.perf_counter()
+        for _ in range(calls):
+            fn()
+        samples.append((time.perf_counter() - start) / calls)
+    return {
+        'median_us': statistics.median(samples) * 1e6,
+        'min_us': min(samples) * 1e6,
+        'calls_per_round': calls,
+        'rounds': rounds,
+    }
+
+
+def _cycle(items):
+    position = [0]
+
+    def next_item():
+        item = items[position[0] % len(items)]
+        position[0] += 1
+        return item
+    return next_item
+
+
+def bench_emotion(corpora: dict, results: dict):
+    import emotion_analyzer
+
+    for name, texts in corpora.items():
+        next_text = _cycle(texts)
+        results[f'emotion.keywords.{name}'] = measure(lambda: emotion_analyzer.find_emotion_keywords(next_text()))
+
+        def uncached():
+            # The TextBlob fallback with an empty cache, i.e. the cost of a new input.
+            emotion_analyzer._normalized_polarity.cache_clear()
+            emotion_analyzer.analyze_emotion(next_text())
+        results[f'emotion.analyze_uncached.{name}'] = measure(uncached, rounds=5)
+        for text in texts:
+            emotion_analyzer.analyze_emotion(text)
+        results[f'emotion.analyze_cached.{name}'] = measure(lambda: emotion_analyzer.analyze_emotion(next_text()))
+
+
+def seed_catalog(backend: InMemoryBackend, size: int):
+    rng = random.Random(SEED)
+    rows = [{'song_title': f'Song {i}', 'artists': f'Artist {rng.randrange(size // 10 + 1)}',
+             'link': f'https://example.com/{i}', 'mood': MOODS[i % len(MOODS)]} for i in range(size)]
+    for start in range(0, size, 10_000):
+        backend.insert_songs(rows[start:start + 10_000])
+
+
+def bench_song_selection(sizes, results: dict):
+    import song_recommender
+
+    for size in sizes:
+        backend = InMemoryBackend()
+        seed_catalog(backend, size)
+        set_storage(backend)
+        catalog = song_recommender.SongCatalog(refresh_interval=0)
+        rotation = song_recommender.SongRotation(catalog, history_seed=0)
+
+        def cold_load():
+            catalog.evict('happy')
+            catalog.get_partition('happy')
+        results[f'songs.load_partition.{size}'] = measure(cold_load, rounds=3, min_time=0)
+        results[f'songs.random_pick.{size}'] = measure(lambda: catalog.random_song('happy'))
+        next_user = _cycle(range(1000))
+        results[f'songs.rotation_pick.{size}'] = measure(lambda: rotation.next_song(next_user(), 'happy'))
+
+
+def bench_history(results: dict):
+    import user_logger
+
+    backend = InMemoryBackend()
+    seed_catalog(backend, 1_000)
+    set_storage(backend)
+    rng = random.Random(SEED)
+    backend.insert_interactions([{'user_id': user_id, 'song_id': rng.randrange(1, 1_001),
+                                  'user_input': 'I had a long day at work and feel tired',
+                                  'detected_mood': rng.choice(MOODS)}
+                                 for user_id in range(100) for _ in range(20)])
+    rows = backend.fetch_user_history(1, user_logger.HISTORY_LIMIT)
+    results['history.format_rows'] = measure(
+        lambda: [user_logger._format_history_row(row, row['newsongs']) for row in rows])
+
+    def cold():
+        user_logger.invalidate_user_history(1)
+        user_logger.get_user_history(1)
+    results['history.get_cold'] = measure(cold)
+    results['history.get_cached'] = measure(lambda: user_logger.get_user_history(1))
+
+
+def bench_bcrypt(results: dict):
+    from password_hasher import PasswordHasher
+
+    for rounds in (10, 12):
+        hasher = PasswordHasher(rounds=rounds, max_workers=1)
+        stored = hasher.hash('benchmark-password')
+        results[f'bcrypt.verify.cost{rounds}'] = measure(
+            lambda: hasher.verify('benchmark-password', stored), rounds=3, min_time=0)
+        hasher.shutdown()
+
+
+def bench_metrics(results: dict):
+    import metrics
+
+    def empty():
+        pass
+    decorated = metrics.timed('benchmark.decorated')(empty)
+
+    def with_block():
+        with metrics.timed('benchmark.with'):
+            pass
+    # The bare call is the baseline: the recording overhead is the difference.
+    results['metrics.bare_call'] = measure(empty)
+    results['metrics.decorated_call'] = measure(decorated)
+    results['metrics.with_timed'] = measure(with_block)
+
+
+_STARTUP_TEMPLATE = """
+import time
+started = time.perf_counter()
+{code}
+print(time.perf_counter() - started)
+"""
+
+
+def _time_fresh_process(code: str, runs: int) -> dict:
+    # Each run is a new interpreter, so nothing is cached in sys.modules. The
+    # interpreter's own start-up is not included, only the timed code.
+    repo = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, STORAGE_BACKEND='memory', WARM_UP_RESOURCES='')
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', _STARTUP_TEMPLATE.format(code=code)], cwd=repo, env=env,
+                                capture_output=True, text=True, check=True).stdout
+        samples.append(float(output.strip().splitlines()[-1]))
+    return {
+        'median_us': statistics.median(samples) * 1e6,
+        'min_us': min(samples) * 1e6,
+        'calls_per_round': 1,
+        'rounds': runs,
+    }
+
+
+def bench_startup(results: dict, runs: int = STARTUP_RUNS):
+    results['startup.import_app'] = _time_fresh_process('import app', runs)
+    # Time to first render: what a new server process spends before the first page is ready.
+    results['startup.first_render'] = _time_fresh_process(
+        "from streamlit.testing.v1 import AppTest\n"
+        "AppTest.from_file('app.py', default_timeout=60).run()", runs)
+
+
+def check_budgets(results: dict, budgets_ms: dict) -> list:
+    """
+    Returns (name, budget_ms, median_ms) for every result over its budget.
+    """
+    return [(name, budget, results[name]['median_us'] / 1000) for name, budget in budgets_ms.items()
+            if name in results and results[name]['median_us'] / 1000 > budget]
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True,
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """
+    Returns (name, old_us, new_us, change) for every benchmark whose median
+    slowed down by more than `threshold` (0.10 = 10%) against the baseline.
+    """
+    regressions = []
+    for name, result in results.items():
+        old = baseline.get(name)
+        if not old or not old['median_us']:
+            continue
+        change = result['median_us'] / old['median_us'] - 1
+        if change > threshold:
+            regressions.append((name, old['median_us'], result['median_us'], change))
+    return regressions
+
+
+SUITES = ('emotion', 'songs', 'history', 'bcrypt', 'metrics', 'startup')
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the recommendation pipeline's hot paths.")
+    parser.add_argument('--output', help='Write results as JSON to this file.')
+    parser.add_argument('--compare', help='Baseline JSON file to compare against.')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='Allowed slowdown before a benchmark counts as a regression (default 0.10).')
+    parser.add_argument('--sizes', default=','.join(str(size) for size in CATALOG_SIZES),
+                        help='Comma-separated catalog sizes for the song selection benchmarks.')
+    parser.add_argument('--suite', action='append', choices=SUITES,
+                        help='Only run these suites (repeatable). Default: all.')
+    parser.add_argument('--budget', action='append', default=[], metavar='NAME=MS',
+                        help='Override a startup budget in milliseconds (repeatable).')
+    args = parser.parse_args(argv)
+
+    budgets = dict(STARTUP_BUDGETS_MS)
+    for budget in args.budget:
+        name, _, value = budget.partition('=')
+        try:
+            budgets[name] = float(value)
+        except ValueError:
+            parser.error(f"Invalid --budget '{budget}', expected NAME=MS.")
+
+    suites = args.suite or SUITES
+    results = {}
+    if 'emotion' in suites:
+        bench_emotion(build_corpora(), results)
+    if 'songs' in suites:
+        bench_song_selection([int(size) for size in args.sizes.split(',')], results)
+    if 'history' in suites:
+        bench_history(results)
+    if 'bcrypt' in suites:
+        bench_bcrypt(results)
+    if 'metrics' in suites:
+        bench_metrics(results)
+    if 'startup' in suites:
+        bench_startup(results)
+
+    width = max(len(name) for name in results)
+    for name, result in results.items():
+        print(f"{name:<{width}}  {result['median_us']:>14.2f} us  (min {result['min_us']:.2f})")
+
+    report = {
+        'meta': {
+            'commit': _git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'created': datetime.now(timezone.utc).isoformat(),
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output:
+            json.dump(report, output, indent=2)
+
+    status = 0
+    for name, budget, median in check_budgets(results, budgets):
+        print(f"OVER BUDGET {name}: {median:.0f} ms > {budget:.0f} ms")
+        status = 1
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare(results, baseline['results'], args.threshold)
+        for name, old, new, change in regressions:
+            print(f"REGRESSION {name}: {old:.2f} us -> {new:.2f} us (+{change:.0%})")
+        if regressions:
+            return 1
+        print(f"No regressions above {args.threshold:.0%} against {baseline['meta'].get('commit', args.compare)}.")
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
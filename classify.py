@@ -0,0 +1,238 @@
+# classify.py
+"""
+Bulk mood classification of JSONL, CSV or TSV files with analyze_emotion.
+
+Records are streamed in chunks through a process pool and written out as soon
+as each chunk is done, so memory use does not depend on the file size:
+
+    python classify.py history.jsonl --output labelled.jsonl --text-field user_input
+    python classify.py dump.csv --output labelled.csv --workers 16 --resume
+
+Every input record is copied to the output with the detected emotion added in
+--label-field. --resume continues an interrupted run by skipping as many input
+records as the output already holds; --start skips a fixed number instead.
+"""
+
+import argparse
+import csv
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+FORMATS = ('jsonl', 'csv', 'tsv')
+# Field delimiter of the tabular formats.
+DELIMITERS = {'csv': ',', 'tsv': '\t'}
+DEFAULT_CHUNK_SIZE = 2000
+PROGRESS_EVERY_SECONDS = 5.0
+
+
+def detect_format(path: str, requested: str = None) -> str:
+    if requested:
+        return requested
+    extension = os.path.splitext(path)[1].lower().lstrip('.')
+    if extension in ('jsonl', 'ndjson', 'json'):
+        return 'jsonl'
+    if extension in DELIMITERS:
+        return extension
+    raise ValueError(f"Cannot tell the format of '{path}'. Pass --format jsonl, csv or tsv.")
+
+
+def read_records(stream, file_format: str):
+    """
+    Yields the input records one at a time as dicts.
+    """
+    if file_format in DELIMITERS:
+        yield from csv.DictReader(stream, delimiter=DELIMITERS[file_format])
+        return
+    for line_number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            raise ValueError(f"Line {line_number} is not valid JSON: {e}") from None
+        if not isinstance(record, dict):
+            raise ValueError(f"Line {line_number} is not a JSON object.")
+        yield record
+
+
+def count_records(path: str, file_format: str) -> int:
+    """
+    Counts the complete records of an earlier output file. A trailing partial
+    record (from a run that was killed mid-write) is cut off, so the next
+    write starts on a fresh line.
+    """
+    if not os.path.exists(path):
+        return 0
+    complete = count = 0
+    record = b''
+    with open(path, 'rb') as stream:
+        for line in stream:
+            if not line.endswith(b'\n'):
+                break
+            record += line
+            # A quoted CSV field may hold newlines: the row ends once its quotes
+            # are balanced (an escaped quote is doubled, so parity still works).
+            if file_format in DELIMITERS and record.count(b'"') % 2:
+                continue
+            complete += len(record)
+            if record.strip():
+                count += 1
+            record = b''
+    with open(path, 'r+b') as stream:
+        stream.truncate(complete)
+    # The CSV/TSV header is not a record.
+    return max(count - 1, 0) if file_format in DELIMITERS else count
+
+
+def check_text_field(path: str, file_format: str, text_field: str):
+    """
+    Raises ValueError if the first record (for CSV/TSV: the header) has no
+    `text_field`, which would otherwise get every record labelled 'neutral'.
+    """
+    with open(path, newline='', encoding='utf-8') as stream:
+        if file_format in DELIMITERS:
+            fields = csv.DictReader(stream, delimiter=DELIMITERS[file_format]).fieldnames
+        else:
+            fields = next(read_records(stream, file_format), None)
+    if fields is not None and text_field not in fields:
+        raise ValueError(f"'{path}' has no '{text_field}' field (it has: {', '.join(map(str, fields))}). "
+                         f"Pass the right one with --text-field.")
+
+
+def classify_chunk(texts: list) -> list:
+    """
+    Runs analyze_emotion over one chunk of texts. Runs in the worker processes.
+    """
+    from emotion_analyzer import analyze_emotion
+
+    return [analyze_emotion(text) if isinstance(text, str) else 'neutral' for text in texts]
+
+
+class _Writer:
+    def __init__(self, stream, file_format: str, label_field: str, write_header: bool):
+        self.stream = stream
+        self.file_format = file_format
+        self.label_field = label_field
+        self.write_header = write_header
+        self._csv = None
+
+    def write(self, records: list):
+        if self.file_format == 'jsonl':
+            self.stream.write(''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in records))
+        else:
+            if self._csv is None:
+                fields = list(records[0])
+                self._csv = csv.DictWriter(self.stream, fieldnames=fields, extrasaction='ignore',
+                                           delimiter=DELIMITERS[self.file_format])
+                if self.write_header:
+                    self._csv.writeheader()
+            self._csv.writerows(records)
+        # Flushed per chunk, so --resume after a crash loses at most the chunks in flight.
+        self.stream.flush()
+
+
+def _chunks(records, size: int):
+    while True:
+        chunk = list(itertools.islice(records, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def classify_file(input_path: str, output_path: str, text_field: str = 'text', label_field: str = 'mood',
+                  file_format: str = None, workers: int = None, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                  start: int = 0, resume: bool = False, progress=None) -> dict:
+    """
+    Classifies every record of `input_path` and writes them to `output_path`.
+    :param start: Number of input records to skip.
+    :param resume: Append to an existing output and skip the records it already holds.
+    :param progress: Optional callable receiving the running totals after each chunk.
+    :return: Totals: records classified, records skipped, seconds and texts per second.
+    """
+    file_format = detect_format(input_path, file_format)
+    check_text_field(input_path, file_format, text_field)
+    workers = workers or os.cpu_count() or 1
+    if resume:
+        start = count_records(output_path, file_format)
+    append = resume and start > 0
+
+    totals = {'classified': 0, 'skipped': start, 'seconds': 0.0, 'texts_per_second': 0.0}
+    started = time.perf_counter()
+    with open(input_path, newline='', encoding='utf-8') as source, \
+            open(output_path, 'a' if append else 'w', newline='', encoding='utf-8') as target:
+        records = itertools.islice(read_records(source, file_format), start, None)
+        writer = _Writer(target, file_format, label_field, write_header=not append)
+        # spawn keeps the workers independent of whatever threads the parent runs.
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+            # At most two chunks per worker are in flight, which bounds memory
+            # while keeping every worker busy. Results are written in input order.
+            in_flight = deque()
+            for chunk in _chunks(records, chunk_size):
+                in_flight.append((chunk, pool.submit(classify_chunk, [record.get(text_field) for record in chunk])))
+                if len(in_flight) >= workers * 2:
+                    _write_next(in_flight, writer, label_field, totals, started, progress)
+            while in_flight:
+                _write_next(in_flight, writer, label_field, totals, started, progress)
+    totals['seconds'] = time.perf_counter() - started
+    totals['texts_per_second'] = totals['classified'] / totals['seconds'] if totals['seconds'] else 0.0
+    return totals
+
+
+def _write_next(in_flight: deque, writer: _Writer, label_field: str, totals: dict, started: float, progress):
+    chunk, future = in_flight.popleft()
+    for record, label in zip(chunk, future.result()):
+        record[label_field] = label
+    writer.write(chunk)
+    totals['classified'] += len(chunk)
+    totals['seconds'] = time.perf_counter() - started
+    totals['texts_per_second'] = totals['classified'] / totals['seconds']
+    if progress:
+        progress(totals)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Label the texts of a JSONL, CSV or TSV file with their mood.')
+    parser.add_argument('input', help='JSONL, CSV or TSV file to classify.')
+    parser.add_argument('--output', required=True, help='File to write the labelled records to.')
+    parser.add_argument('--format', choices=FORMATS, help='Input/output format (default: from the extension).')
+    parser.add_argument('--text-field', default='text', help="Field holding the text (default 'text').")
+    parser.add_argument('--label-field', default='mood', help="Field to write the emotion to (default 'mood').")
+    parser.add_argument('--workers', type=int, help='Worker processes (default: one per CPU).')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help=f'Texts sent to a worker at a time (default {DEFAULT_CHUNK_SIZE}).')
+    start = parser.add_mutually_exclusive_group()
+    start.add_argument('--start', type=int, default=0, help='Skip this many input records.')
+    start.add_argument('--resume', action='store_true',
+                       help='Append to --output, skipping the records it already holds.')
+    args = parser.parse_args(argv)
+
+    last_report = [0.0]
+
+    def report(totals):
+        if totals['seconds'] - last_report[0] >= PROGRESS_EVERY_SECONDS:
+            last_report[0] = totals['seconds']
+            print(f"{totals['skipped'] + totals['classified']} records done "
+                  f"({totals['texts_per_second']:.0f} texts/s)", file=sys.stderr)
+
+    try:
+        totals = classify_file(args.input, args.output, args.text_field, args.label_field, args.format,
+                               args.workers, args.chunk_size, args.start, args.resume, report)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    except KeyboardInterrupt:
+        print("Interrupted. Run again with --resume to continue.", file=sys.stderr)
+        return 130
+    print(f"Classified {totals['classified']} texts in {totals['seconds']:.1f}s "
+          f"({totals['texts_per_second']:.0f} texts/s), skipped {totals['skipped']}.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,5 +1,91 @@
-from textblob import TextBlob
+import functools
+import os
+import re
+from collections import namedtuple
+from typing import Optional
 
+import resources
+from metrics import timed
+
+# Every label the analyzer can return, in the column order used by analyze_emotions.
+EMOTIONS = ('happy', 'calm', 'sad', 'angry', 'neutral', 'fear', 'surprise')
+# TextBlob polarity cutoffs for the happy/sad/neutral fallback.
+HAPPY_POLARITY = 0.4
+SAD_POLARITY = -0.4
+# Number of distinct (normalized) inputs whose polarity is remembered.
+POLARITY_CACHE_SIZE = int(os.environ.get("POLARITY_CACHE_SIZE", 4096))
+
+# Keyword lexicon for the emotions that polarity cannot tell apart.
+# The order of the entries is the priority used when several emotions match.
+EMOTION_KEYWORDS = {
+    'angry': ['angry', 'furious', 'annoyed', 'frustrated', 'rage', 'mad', 'irritated'],
+    'calm': ['calm', 'peaceful', 'relaxed', 'tranquil', 'chill', 'serene'],
+    'fear': ['anxious', 'scared', 'afraid', 'fear', 'terrified', 'anxiety', 'panic'],
+    'surprise': ['surprised', 'shocked', 'stunned', 'amazed', 'unexpected'],
+}
+
+
+def _trie_to_regex(node: dict) -> str:
+    # '' marks the end of a keyword; the remaining keys are next characters.
+    alternatives = [re.escape(char) + _trie_to_regex(child) for char, child in sorted(node.items()) if char]
+    if not alternatives:
+        return ''
+    pattern = alternatives[0] if len(alternatives) == 1 else '(?:' + '|'.join(alternatives) + ')'
+    if '' in node:
+        pattern = '(?:' + pattern + ')?'
+    return pattern
+
+
+def compile_keyword_matcher(lexicon: dict):
+    """
+    Compiles a lexicon of {emotion: [keywords]} into one word-bounded regex.
+    The keywords are merged into a prefix trie first, so matching cost depends
+    on the length of the text rather than on the number of keywords.
+    :return: The compiled pattern and a mapping of keyword -> emotion.
+    """
+    keyword_emotions = {}
+    for emotion, keywords in lexicon.items():
+        for keyword in keywords:
+            # A keyword listed under two emotions belongs to the higher-priority one.
+            keyword_emotions.setdefault(keyword.lower(), emotion)
+
+    trie = {}
+    for keyword in keyword_emotions:
+        node = trie
+        for char in keyword:
+            node = node.setdefault(char, {})
+        node[''] = {}
+    return re.compile(r'\b' + _trie_to_regex(trie) + r'\b'), keyword_emotions
+
+
+_KEYWORD_PATTERN, _KEYWORD_EMOTIONS = compile_keyword_matcher(EMOTION_KEYWORDS)
+_EMOTION_PRIORITY = {emotion: rank for rank, emotion in enumerate(EMOTION_KEYWORDS)}
+
+
+def find_emotion_keywords(text: str) -> list:
+    """
+    Finds every lexicon keyword in the text in a single scan.
+    :param text: User's input string.
+    :return: A list of (emotion, position) tuples in the order they appear.
+    """
+    if not text:
+        return []
+    return [(_KEYWORD_EMOTIONS[match.group()], match.start())
+            for match in _KEYWORD_PATTERN.finditer(text.lower())]
+
+
+def keyword_emotion(text: str) -> Optional[str]:
+    """
+    Returns the highest-priority emotion whose keywords appear in the text,
+    or None if there are none. This is the cheap first step of analyze_emotion.
+    """
+    matches = find_emotion_keywords(text)
+    if matches:
+        return min((emotion for emotion, _ in matches), key=_EMOTION_PRIORITY.__getitem__)
+    return None
+
+
+@timed('emotion.analyze')
 def analyze_emotion(text: str) -> str:
     """
     Analyzes the user's input and maps it to a specific emotion
@@ -10,33 +96,137 @@ def analyze_emotion(text: str) -> str:
     if not text:
         return 'neutral'
 
-    # Convert the text to lowercase for case-insensitive matching
-    lower_text = text.lower()
-    
     # 1. Keyword-based emotion detection for specific moods
     # This is the primary method for emotions not covered by polarity.
-    anger_keywords = ['angry', 'furious', 'annoyed', 'frustrated', 'rage', 'mad', 'irritated']
-    calm_keywords = ['calm', 'peaceful', 'relaxed', 'tranquil', 'chill', 'serene']
-    fear_keywords = ['anxious', 'scared', 'afraid', 'fear', 'terrified', 'anxiety', 'panic']
-    surprise_keywords = ['surprised', 'shocked', 'stunned', 'amazed', 'unexpected']
-
-    if any(word in lower_text for word in anger_keywords):
-        return 'angry'
-    elif any(word in lower_text for word in calm_keywords):
-        return 'calm'
-    elif any(word in lower_text for word in fear_keywords):
-        return 'fear'
-    elif any(word in lower_text for word in surprise_keywords):
-        return 'surprise'
+    # When several emotions match, the lexicon order decides (angry > calm > fear > surprise).
+    emotion = keyword_emotion(text)
+    if emotion:
+        return emotion
 
     # 2. Polarity-based emotion detection for happy, sad, and neutral
     # This is the fallback method if no specific keywords are found.
-    blob = TextBlob(text)
-    polarity = blob.sentiment.polarity
-    
-    if polarity > 0.4:
+    return _polarity_emotion(_polarity(text))
+
+
+def _create_sentiment_analyzer():
+    # TextBlob (and the pattern lexicon behind it) is slow to import, so it is
+    # only loaded the first time a text actually needs the polarity fallback.
+    from textblob.en.sentiments import PatternAnalyzer
+    analyzer = PatternAnalyzer()
+    # The lexicon itself is read on the first analysis; do that here too.
+    analyzer.analyze('warm up')
+    return analyzer
+
+
+resources.register('sentiment_analyzer', _create_sentiment_analyzer)
+
+
+def _get_sentiment_analyzer():
+    return resources.get('sentiment_analyzer')
+
+
+def _normalize_text(text: str) -> str:
+    # Only whitespace is collapsed: the pattern lexicon is case-sensitive
+    # (e.g. emoticons like ':-D'), so the case must reach the analyzer unchanged.
+    return ' '.join(text.split())
+
+
+@functools.lru_cache(maxsize=POLARITY_CACHE_SIZE)
+@timed('emotion.polarity')
+def _normalized_polarity(normalized_text: str) -> float:
+    return _get_sentiment_analyzer().analyze(normalized_text).polarity
+
+
+def _polarity(text: str) -> float:
+    return _normalized_polarity(_normalize_text(text))
+
+
+def polarity_cache_info():
+    """
+    Returns the hits, misses, maxsize and current size of the polarity cache.
+    """
+    return _normalized_polarity.cache_info()
+
+
+def _polarity_emotion(polarity: float) -> str:
+    if polarity > HAPPY_POLARITY:
         return 'happy'
-    elif polarity < -0.4:
+    elif polarity < SAD_POLARITY:
         return 'sad'
     else:
-        return 'neutral'
\ No newline at end of file
+        return 'neutral'
+
+
+EmotionScores = namedtuple('EmotionScores', ['labels', 'scores', 'confidence'])
+_LEXICON_WEIGHTS = None
+
+
+def _lexicon_weights():
+    # Built on first use so that NumPy/SciPy are only imported by batch callers.
+    global _LEXICON_WEIGHTS
+    if _LEXICON_WEIGHTS is None:
+        import numpy as np
+
+        terms = {keyword: column for column, keyword in enumerate(_KEYWORD_EMOTIONS)}
+        weights = np.zeros((len(terms), len(EMOTIONS)), dtype=np.float32)
+        for keyword, column in terms.items():
+            weights[column, EMOTIONS.index(_KEYWORD_EMOTIONS[keyword])] = 1.0
+        _LEXICON_WEIGHTS = terms, weights
+    return _LEXICON_WEIGHTS
+
+
+@timed('emotion.analyze_batch')
+def analyze_emotions(texts) -> EmotionScores:
+    """
+    Scores a batch of texts against all seven emotions at once.
+    Keyword hits are collected into a sparse document-term matrix and multiplied
+    by the term x emotion weight matrix; texts without any keyword fall back to
+    TextBlob polarity, as in analyze_emotion.
+    :param texts: An iterable of input strings.
+    :return: EmotionScores with the label per text (same as analyze_emotion),
+             an (n, 7) array of scores in EMOTIONS order that sum to 1 per row,
+             and the score of the chosen label as its confidence.
+    """
+    import numpy as np
+    from scipy import sparse
+
+    texts = [text or '' for text in texts]
+    terms, weights = _lexicon_weights()
+
+    rows, columns = [], []
+    for row, text in enumerate(texts):
+        for match in _KEYWORD_PATTERN.finditer(text.lower()):
+            rows.append(row)
+            columns.append(terms[match.group()])
+    doc_terms = sparse.csr_matrix(
+        (np.ones(len(rows), dtype=np.float32), (rows, columns)),
+        shape=(len(texts), len(terms)),
+    )
+    counts = np.asarray(doc_terms @ weights)
+    totals = counts.sum(axis=1)
+    has_keywords = totals > 0
+
+    scores = np.zeros_like(counts)
+    scores[has_keywords] = counts[has_keywords] / totals[has_keywords, None]
+
+    # Keyword texts take the highest-priority emotion present, like analyze_emotion.
+    priority = [EMOTIONS.index(emotion) for emotion in EMOTION_KEYWORDS]
+    first_present = (counts[:, priority] > 0).argmax(axis=1)
+    label_columns = np.asarray(priority)[first_present]
+
+    # Polarity fallback: happy/sad take the positive/negative part, neutral the rest.
+    happy, sad, neutral = EMOTIONS.index('happy'), EMOTIONS.index('sad'), EMOTIONS.index('neutral')
+    for row in np.flatnonzero(~has_keywords):
+        if not texts[row]:
+            scores[row, neutral] = 1.0
+            label_columns[row] = neutral
+            continue
+        polarity = _polarity(texts[row])
+        scores[row, happy] = max(polarity, 0.0)
+        scores[row, sad] = max(-polarity, 0.0)
+        scores[row, neutral] = 1.0 - abs(polarity)
+        label_columns[row] = EMOTIONS.index(_polarity_emotion(polarity))
+
+    labels = [EMOTIONS[column] for column in label_columns]
+    confidence = scores[np.arange(len(texts)), label_columns]
+    return EmotionScores(labels, scores, confidence)
@@ -0,0 +1,209 @@
+# import_songs.py
+"""
+Streaming import of song dumps (JSONL or CSV) into the `newsongs` table.
+
+    python import_songs.py songs.csv --title-field name --artists-field artist
+    python import_songs.py songs.jsonl --assign-moods --lyrics-field lyrics --backend sqlite
+
+Rows are validated (a title, artists and an http(s) link are required),
+deduplicated on (song_title, artists) and upserted in batches, so re-running
+an import updates songs instead of duplicating them.
+Songs without a valid mood are skipped, or with --assign-moods labelled by the
+emotion analyzer from their title (and lyrics, if a lyrics field is given).
+"""
+
+import argparse
+import hashlib
+import itertools
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import resources
+
+# Settings are read at import time by the service modules, so .env goes first.
+resources.load_environment()
+
+from classify import FORMATS, detect_format, read_records
+from storage import BACKENDS, SQLiteBackend, StorageError, create_storage
+
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_WRITERS = 2
+PROGRESS_EVERY_SECONDS = 5.0
+
+
+def _clean(value) -> str:
+    return ' '.join(value.split()) if isinstance(value, str) else ''
+
+
+def song_key(title: str, artists: str) -> int:
+    """
+    64-bit hash of a normalized (title, artists) pair. Only the hashes of the
+    songs seen so far are kept in memory (about 60 bytes per song in a set).
+    """
+    normalized = f'{title.casefold()}\x1f{artists.casefold()}'.encode('utf-8')
+    return int.from_bytes(hashlib.blake2b(normalized, digest_size=8).digest(), 'little')
+
+
+class SongImporter:
+    """
+    Turns input records into validated, unique `newsongs` rows and writes them
+    in batches on a small thread pool while the next batch is being prepared.
+    """
+
+    def __init__(self, backend, title_field: str = 'song_title', artists_field: str = 'artists',
+                 link_field: str = 'link', mood_field: str = 'mood', lyrics_field: str = None,
+                 assign_moods: bool = False, batch_size: int = DEFAULT_BATCH_SIZE, writers: int = DEFAULT_WRITERS):
+        from emotion_analyzer import EMOTIONS
+
+        self.backend = backend
+        self.title_field = title_field
+        self.artists_field = artists_field
+        self.link_field = link_field
+        self.mood_field = mood_field
+        self.lyrics_field = lyrics_field
+        self.assign_moods = assign_moods
+        self.batch_size = batch_size
+        self.writers = writers
+        self._moods = set(EMOTIONS)
+        self._seen = set()
+        self.counts = {'read': 0, 'written': 0, 'duplicates': 0, 'invalid': 0, 'untagged': 0,
+                       'moods_assigned': 0, 'failed': 0}
+
+    def _validate(self, record: dict):
+        """
+        Returns the cleaned row, or None if the record is invalid or a duplicate.
+        """
+        title = _clean(record.get(self.title_field))
+        artists = _clean(record.get(self.artists_field))
+        link = _clean(record.get(self.link_field))
+        # The app links every recommendation, and an upsert would overwrite a stored link.
+        if not title or not artists or not link.startswith(('http://', 'https://')):
+            self.counts['invalid'] += 1
+            return None
+        key = song_key(title, artists)
+        if key in self._seen:
+            self.counts['duplicates'] += 1
+            return None
+        self._seen.add(key)
+        mood = _clean(record.get(self.mood_field)).lower()
+        return {'song_title': title, 'artists': artists, 'link': link,
+                'mood': mood if mood in self._moods else None}
+
+    def _tag(self, rows: list, records: list) -> list:
+        untagged = [index for index, row in enumerate(rows) if row['mood'] is None]
+        if untagged and self.assign_moods:
+            from emotion_analyzer import analyze_emotions
+
+            texts = [rows[index]['song_title'] + '. ' + _clean(records[index].get(self.lyrics_field))
+                     if self.lyrics_field else rows[index]['song_title'] for index in untagged]
+            for index, label in zip(untagged, analyze_emotions(texts).labels):
+                rows[index]['mood'] = label
+            self.counts['moods_assigned'] += len(untagged)
+            return rows
+        self.counts['untagged'] += len(untagged)
+        return [row for row in rows if row['mood'] is not None]
+
+    def _prepare(self, records: list) -> list:
+        rows, kept = [], []
+        for record in records:
+            row = self._validate(record)
+            if row is not None:
+                rows.append(row)
+                kept.append(record)
+        return self._tag(rows, kept)
+
+    def _collect(self, future, size: int):
+        try:
+            self.counts['written'] += future.result()
+        except StorageError as e:
+            self.counts['failed'] += size
+            print(f"Error writing a batch of {size} songs: {e}", file=sys.stderr)
+
+    def run(self, records, progress=None) -> dict:
+        """
+        Imports every record of an iterable of dicts.
+        :param progress: Optional callable receiving the running counts after each batch.
+        :return: The counts, plus seconds and songs written per second.
+        """
+        started = time.perf_counter()
+        records = iter(records)
+        with ThreadPoolExecutor(max_workers=self.writers, thread_name_prefix='import') as pool:
+            # Bounded number of batches in flight, so memory does not grow with the file.
+            in_flight = deque()
+            while True:
+                batch = list(itertools.islice(records, self.batch_size))
+                if not batch:
+                    break
+                self.counts['read'] += len(batch)
+                rows = self._prepare(batch)
+                if rows:
+                    # Batches never share a key (the hash index sees every row),
+                    # so they can be upserted concurrently.
+                    in_flight.append((pool.submit(self.backend.upsert_songs, rows), len(rows)))
+                while len(in_flight) > self.writers:
+                    self._collect(*in_flight.popleft())
+                if progress:
+                    progress(self.counts)
+            while in_flight:
+                self._collect(*in_flight.popleft())
+        seconds = time.perf_counter() - started
+        return dict(self.counts, seconds=seconds, songs_per_second=self.counts['written'] / seconds if seconds else 0.0)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Import a JSONL or CSV song dump into the newsongs table.')
+    parser.add_argument('input', help='JSONL or CSV file with one song per record.')
+    parser.add_argument('--format', choices=FORMATS, help='Input format (default: from the extension).')
+    parser.add_argument('--backend', choices=sorted(BACKENDS), help='Storage backend (default: STORAGE_BACKEND).')
+    parser.add_argument('--sqlite-path', help='Import into this SQLite file (implies --backend sqlite).')
+    parser.add_argument('--title-field', default='song_title')
+    parser.add_argument('--artists-field', default='artists')
+    parser.add_argument('--link-field', default='link')
+    parser.add_argument('--mood-field', default='mood')
+    parser.add_argument('--lyrics-field', help='Field with lyrics to analyze along with the title.')
+    parser.add_argument('--assign-moods', action='store_true',
+                        help='Label songs without a valid mood with the emotion analyzer instead of skipping them.')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help=f'Songs per upsert (default {DEFAULT_BATCH_SIZE}).')
+    parser.add_argument('--writers', type=int, default=DEFAULT_WRITERS,
+                        help=f'Batches written concurrently (default {DEFAULT_WRITERS}).')
+    args = parser.parse_args(argv)
+
+    try:
+        file_format = detect_format(args.input, args.format)
+        if args.sqlite_path:
+            backend = SQLiteBackend(args.sqlite_path)
+        elif args.backend:
+            backend = create_storage(args.backend)
+        else:
+            backend = create_storage()
+    except (ValueError, StorageError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+
+    importer = SongImporter(backend, args.title_field, args.artists_field, args.link_field, args.mood_field,
+                            args.lyrics_field, args.assign_moods, args.batch_size, args.writers)
+    last_report = [time.perf_counter()]
+
+    def report(counts):
+        now = time.perf_counter()
+        if now - last_report[0] >= PROGRESS_EVERY_SECONDS:
+            last_report[0] = now
+            print(f"{counts['read']} records read, {counts['written']} songs written", file=sys.stderr)
+
+    try:
+        with open(args.input, newline='', encoding='utf-8') as source:
+            totals = importer.run(read_records(source, file_format), report)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    print(f"Wrote {totals['written']} songs in {totals['seconds']:.1f}s ({totals['songs_per_second']:.0f}/s). "
+          f"Read {totals['read']}, duplicates {totals['duplicates']}, invalid {totals['invalid']}, "
+          f"untagged {totals['untagged']}, moods assigned {totals['moods_assigned']}, failed {totals['failed']}.")
+    return 1 if totals['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
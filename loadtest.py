@@ -0,0 +1,456 @@
+# loadtest.py
+"""
+Load test of one server process. N concurrent users run login -> analyze ->
+history sessions against the app's service functions, each on its own thread,
+the way Streamlit runs every session's script.
+
+Storage is a seeded local backend (memory or SQLite) with injected latency on
+every operation, standing in for the Supabase round trips:
+
+    python loadtest.py --users 50 --duration 30 --latency-ms 20
+    python loadtest.py --scenarios loadtest_scenarios.json --output load.json
+
+Every scenario runs in a fresh interpreter with its `env` applied, so settings
+read at import time (cache sizes, pool sizes, bcrypt cost) can be compared side
+by side. Per stage the report gives throughput, p50/p95/p99 latency and the CPU
+time of the session thread. Memory and total CPU per stage come from a short
+serial pass under tracemalloc after the load, because the allocations of
+concurrent sessions (and the work they hand to pools) cannot be told apart.
+"""
+
+import argparse
+import gc
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import resources
+
+# Settings are read at import time by the service modules, so .env goes first.
+# Scenario `env` values are already in os.environ and win over the file.
+resources.load_environment()
+
+import metrics
+from benchmark import SEED, build_corpora, seed_catalog
+from storage import InMemoryBackend, SQLiteBackend, set_storage
+
+STAGES = ('login', 'history', 'analyze', 'recommend', 'log')
+LOADTEST_PASSWORD = 'load-test-password'
+PROGRESS_EVERY_SECONDS = 5.0
+DEFAULT_SCENARIO = {
+    'name': 'default',
+    'users': 20,
+    'duration_seconds': 30.0,
+    # Users start evenly spread over this many seconds.
+    'ramp_up_seconds': 5.0,
+    'actions_per_session': 5,
+    # Mean pause before each action (exponentially distributed), like a user typing.
+    'think_time_ms': 500.0,
+    'catalog_size': 10_000,
+    # Distinct texts per corpus kind; fewer texts means more polarity cache hits.
+    'corpus_size': 200,
+    'backend': 'memory',
+    # Injected latency per storage operation in milliseconds, with 'default' for the rest.
+    'latency_ms': {'default': 20.0},
+    # Each latency is drawn uniformly from +/- this fraction of its value.
+    'jitter': 0.5,
+    # Calls per stage in the serial memory and CPU pass (0 skips it).
+    'profile_calls': 20,
+    # Create the lazily built resources (NLP model, pools, ...) before the load,
+    # so the run measures a warm process. False measures a cold start.
+    'warm_up': True,
+    # Environment variables for the scenario's process, e.g. {"BCRYPT_MAX_WORKERS": "4"}.
+    'env': {},
+}
+
+
+class LatencyBackend:
+    """
+    Wraps a storage backend and sleeps before every call, like a network round
+    trip. Sleeping releases the GIL just as waiting on a socket does. Calls are
+    timed as 'db.<operation>' stages, the same names the Supabase backend uses.
+    """
+
+    def __init__(self, backend, latency_ms: dict, jitter: float = 0.0, seed: int = SEED):
+        self._backend = backend
+        self._latency_ms = latency_ms
+        self._jitter = jitter
+        self._random = random.Random(seed)
+
+    def __getattr__(self, name):
+        attribute = getattr(self._backend, name)
+        if not callable(attribute):
+            return attribute
+        latency = self._latency_ms.get(name, self._latency_ms.get('default', 0.0)) / 1000
+        span = metrics.timed(f'db.{name}')
+
+        def call(*args, **kwargs):
+            with span:
+                if latency > 0:
+                    time.sleep(latency * self._random.uniform(1 - self._jitter, 1 + self._jitter))
+                return attribute(*args, **kwargs)
+        return call
+
+
+def load_scenarios(path: str) -> list:
+    """
+    Reads a scenario file: {"defaults": {...}, "scenarios": [{"name": ..., ...}]}.
+    Each scenario is the defaults updated with its own settings.
+    :raises ValueError: If a setting is unknown or the file has no scenarios.
+    """
+    with open(path, encoding='utf-8') as source:
+        document = json.load(source)
+    defaults = document.get('defaults', {})
+    scenarios = [dict(defaults, **scenario) for scenario in document.get('scenarios', [])]
+    if not scenarios:
+        raise ValueError(f"{path} has no scenarios.")
+    return [make_scenario(scenario) for scenario in scenarios]
+
+
+def make_scenario(settings: dict) -> dict:
+    """
+    Fills in the default of every setting that is not given.
+    :raises ValueError: If a setting is unknown.
+    """
+    unknown = sorted(set(settings) - set(DEFAULT_SCENARIO))
+    if unknown:
+        raise ValueError(f"Unknown scenario settings {unknown}. Use any of {sorted(DEFAULT_SCENARIO)}.")
+    return dict(DEFAULT_SCENARIO, **settings)
+
+
+def _percentile(sorted_values: list, q: float) -> float:
+    # Nearest rank, so every reported value was actually observed.
+    if not sorted_values:
+        return 0.0
+    return sorted_values[max(0, math.ceil(q * len(sorted_values)) - 1)]
+
+
+class _SessionRecorder:
+    """
+    Samples of one virtual user. Each user thread has its own, so recording takes no lock.
+    """
+
+    def __init__(self):
+        self.stages = {stage: {'seconds': [], 'cpu_seconds': 0.0, 'errors': 0} for stage in STAGES}
+        self.sessions = 0
+
+    def run(self, stage: str, fn, ok=None):
+        """
+        Calls fn() as one sample of the stage. An exception, or a result that
+        `ok` rejects, counts as an error.
+        """
+        record = self.stages[stage]
+        started, cpu_started = time.perf_counter(), time.thread_time()
+        try:
+            result = fn()
+            failed = ok is not None and not ok(result)
+        except Exception:
+            result, failed = None, True
+        record['seconds'].append(time.perf_counter() - started)
+        record['cpu_seconds'] += time.thread_time() - cpu_started
+        record['errors'] += failed
+        return result
+
+
+def _think(rng: random.Random, mean_ms: float, stop_at: float):
+    if mean_ms > 0:
+        time.sleep(min(rng.expovariate(1000 / mean_ms), max(0.0, stop_at - time.monotonic())))
+
+
+def _user_loop(user: dict, texts: list, scenario: dict, start_at: float, stop_at: float,
+               recorder: _SessionRecorder, rng: random.Random):
+    from auth_service import sign_in_user
+    from emotion_analyzer import analyze_emotion
+    from song_recommender import get_song_recommender
+    from user_logger import get_user_history, invalidate_user_history, log_user_interaction
+
+    time.sleep(max(0.0, start_at - time.monotonic()))
+    while time.monotonic() < stop_at:
+        # A session: log in, see the history, then a few analyze -> recommend -> log rounds.
+        user_id, _ = recorder.run('login', lambda: sign_in_user(user['email'], LOADTEST_PASSWORD),
+                                  ok=lambda result: result[0] is not None) or (None, None)
+        if user_id is None:
+            _think(rng, scenario['think_time_ms'], stop_at)
+            continue
+        invalidate_user_history(user_id)
+        recorder.run('history', lambda: get_user_history(user_id))
+        for _ in range(scenario['actions_per_session']):
+            _think(rng, scenario['think_time_ms'], stop_at)
+            if time.monotonic() >= stop_at:
+                break
+            text = rng.choice(texts)
+            mood = recorder.run('analyze', lambda: analyze_emotion(text))
+            if mood is None:
+                continue
+            song = recorder.run('recommend', lambda: get_song_recommender(mood, user_id),
+                                ok=lambda result: result is not None)
+            if song is not None:
+                recorder.run('log', lambda: log_user_interaction(user_id, text, mood, song['id'], song), ok=bool)
+            recorder.run('history', lambda: get_user_history(user_id))
+        recorder.sessions += 1
+
+
+def _create_backend(name: str):
+    if name == 'memory':
+        return InMemoryBackend()
+    if name == 'sqlite':
+        return SQLiteBackend(':memory:')
+    raise ValueError(f"Unknown load test backend '{name}'. Use 'memory' or 'sqlite'.")
+
+
+def _seed_users(backend, count: int) -> list:
+    from password_hasher import password_hasher
+
+    # One hash for everyone: every login still pays a full bcrypt verification.
+    password_hash = password_hasher.hash(LOADTEST_PASSWORD)
+    users = []
+    for index in range(count):
+        email = f'load{index}@example.com'
+        user = backend.create_user({'name': f'Load User {index}', 'age': 30, 'email': email,
+                                    'username': f'load{index}', 'password_hash': password_hash})
+        users.append({'id': user['id'], 'email': email})
+    return users
+
+
+def profile_stages(user: dict, texts: list, calls: int) -> dict:
+    """
+    Runs each stage `calls` times in a row for one user under tracemalloc.
+    :return: Per stage, the process CPU per call (including pool threads), the
+             peak of memory allocated while it ran, and the memory still held
+             afterwards (e.g. by caches), in KiB.
+    """
+    from auth_service import sign_in_user
+    from emotion_analyzer import analyze_emotion
+    from song_recommender import get_song_recommender
+    from user_logger import get_user_history, invalidate_user_history, log_user_interaction
+
+    next_text = iter(texts * (calls // len(texts) + 1)).__next__
+    mood = analyze_emotion(texts[0])
+    song = get_song_recommender(mood, user['id'])
+
+    def history():
+        invalidate_user_history(user['id'])
+        get_user_history(user['id'])
+
+    steps = {
+        'login': lambda: sign_in_user(user['email'], LOADTEST_PASSWORD),
+        'history': history,
+        'analyze': lambda: analyze_emotion(next_text()),
+        'recommend': lambda: get_song_recommender('happy', user['id']),
+        'log': lambda: song and log_user_interaction(user['id'], texts[0], mood, song['id'], song),
+    }
+    profile = {}
+    tracemalloc.start()
+    try:
+        for stage, fn in steps.items():
+            gc.collect()
+            baseline = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            cpu_started = time.process_time()
+            for _ in range(calls):
+                fn()
+            cpu = time.process_time() - cpu_started
+            current, peak = tracemalloc.get_traced_memory()
+            profile[stage] = {
+                'cpu_ms_per_call': cpu / calls * 1000,
+                'peak_kib': (peak - baseline) / 1024,
+                'retained_kib': (current - baseline) / 1024,
+            }
+    finally:
+        tracemalloc.stop()
+    return profile
+
+
+def _max_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is in KiB on Linux and in bytes on macOS.
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+
+def run_scenario(scenario: dict) -> dict:
+    """
+    Seeds a local backend, runs the scenario's users against it in this process
+    and returns the report. Use run_in_subprocess() to apply the scenario's env.
+    """
+    from password_hasher import password_hasher
+    from user_logger import interaction_writer
+
+    backend = _create_backend(scenario['backend'])
+    seed_catalog(backend, scenario['catalog_size'])
+    users = _seed_users(backend, scenario['users'])
+    corpora = build_corpora(scenario['corpus_size'])
+    texts = corpora['short'] + corpora['keyword_heavy'] + corpora['keyword_free']
+    set_storage(LatencyBackend(backend, scenario['latency_ms'], scenario['jitter']))
+    if scenario['warm_up']:
+        # The services register their resources when imported, so import them first.
+        import auth_service
+        from emotion_analyzer import EMOTIONS
+        from song_recommender import catalog
+        resources.warm_up(background=False)
+        for mood in EMOTIONS:
+            catalog.get_partition(mood)
+    metrics.reset()
+
+    recorders = [_SessionRecorder() for _ in users]
+    started = time.monotonic()
+    stop_at = started + scenario['ramp_up_seconds'] + scenario['duration_seconds']
+    step = scenario['ramp_up_seconds'] / len(users) if users else 0.0
+    threads = [threading.Thread(target=_user_loop, name=f'user-{index}', daemon=True,
+                                args=(user, texts, scenario, started + index * step, stop_at,
+                                      recorder, random.Random(SEED + index)))
+               for index, (user, recorder) in enumerate(zip(users, recorders))]
+    cpu_started = time.process_time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        while thread.is_alive():
+            thread.join(PROGRESS_EVERY_SECONDS)
+            if thread.is_alive():
+                print(f"[{scenario['name']}] {time.monotonic() - started:.0f}s, "
+                      f"{sum(recorder.sessions for recorder in recorders)} sessions", file=sys.stderr)
+    elapsed = time.monotonic() - started
+    cpu = time.process_time() - cpu_started
+    interaction_writer.flush()
+
+    stages = {}
+    for stage in STAGES:
+        seconds = sorted(sample for recorder in recorders for sample in recorder.stages[stage]['seconds'])
+        count = len(seconds)
+        errors = sum(recorder.stages[stage]['errors'] for recorder in recorders)
+        cpu_seconds = sum(recorder.stages[stage]['cpu_seconds'] for recorder in recorders)
+        stages[stage] = {
+            'count': count,
+            'errors': errors,
+            'per_second': count / elapsed,
+            'p50_ms': _percentile(seconds, 0.50) * 1000,
+            'p95_ms': _percentile(seconds, 0.95) * 1000,
+            'p99_ms': _percentile(seconds, 0.99) * 1000,
+            'max_ms': seconds[-1] * 1000 if seconds else 0.0,
+            'thread_cpu_ms': cpu_seconds / count * 1000 if count else 0.0,
+        }
+    report = {
+        'scenario': scenario,
+        'seconds': elapsed,
+        'sessions': sum(recorder.sessions for recorder in recorders),
+        'stages': stages,
+        'process': {'cpu_percent': cpu / elapsed * 100, 'max_rss_mb': _max_rss_mb(), 'threads': threading.active_count()},
+        'bcrypt': password_hasher.stats(),
+        'interaction_writer': interaction_writer.stats(),
+        # Stages timed inside the services (bcrypt queueing, db.* operations, ...).
+        'internal': metrics.summary(),
+    }
+    if scenario['profile_calls'] and users:
+        report['profile'] = profile_stages(users[0], texts, scenario['profile_calls'])
+    return report
+
+
+def run_in_subprocess(scenario: dict) -> dict:
+    """
+    Runs a scenario in a new interpreter with its `env` applied and returns the report.
+    :raises subprocess.CalledProcessError: If the run fails.
+    """
+    env = dict(os.environ, **{name: str(value) for name, value in scenario['env'].items()})
+    handle, result_path = tempfile.mkstemp(suffix='.json', prefix='loadtest-')
+    os.close(handle)
+    try:
+        subprocess.run([sys.executable, os.path.abspath(__file__), '--run-scenario', result_path],
+                       input=json.dumps(scenario), text=True, env=env, check=True,
+                       cwd=os.path.dirname(os.path.abspath(__file__)))
+        with open(result_path, encoding='utf-8') as result:
+            return json.load(result)
+    finally:
+        os.remove(result_path)
+
+
+def print_report(reports: list):
+    width = max(len(report['scenario']['name']) for report in reports)
+    print(f"{'scenario':<{width}}  {'stage':<9}  {'count':>7}  {'errors':>6}  {'per s':>8}  "
+          f"{'p50 ms':>8}  {'p95 ms':>8}  {'p99 ms':>8}  {'cpu ms':>7}")
+    for report in reports:
+        name = report['scenario']['name']
+        for stage, row in report['stages'].items():
+            print(f"{name:<{width}}  {stage:<9}  {row['count']:>7}  {row['errors']:>6}  {row['per_second']:>8.1f}  "
+                  f"{row['p50_ms']:>8.1f}  {row['p95_ms']:>8.1f}  {row['p99_ms']:>8.1f}  {row['thread_cpu_ms']:>7.2f}")
+        process = report['process']
+        rss = f"{process['max_rss_mb']:.0f} MB" if process['max_rss_mb'] is not None else 'n/a'
+        print(f"{name:<{width}}  {report['sessions'] / report['seconds']:.2f} sessions/s, "
+              f"CPU {process['cpu_percent']:.0f}%, max RSS {rss}, "
+              f"bcrypt rejected {report['bcrypt']['rejected']}, log dropped {report['interaction_writer']['dropped']}")
+        for stage, row in report.get('profile', {}).items():
+            print(f"{name:<{width}}  serial {stage:<9}  {row['cpu_ms_per_call']:>8.2f} CPU ms/call  "
+                  f"peak {row['peak_kib']:>8.1f} KiB  retained {row['retained_kib']:>8.1f} KiB")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Load test the app services with concurrent simulated users.')
+    parser.add_argument('--scenarios', help='JSON file of scenarios to run one after another.')
+    parser.add_argument('--output', help='Write the reports as JSON to this file.')
+    parser.add_argument('--users', type=int)
+    parser.add_argument('--duration', type=float, dest='duration_seconds')
+    parser.add_argument('--ramp-up', type=float, dest='ramp_up_seconds')
+    parser.add_argument('--actions', type=int, dest='actions_per_session')
+    parser.add_argument('--think-ms', type=float, dest='think_time_ms')
+    parser.add_argument('--catalog-size', type=int)
+    parser.add_argument('--backend', choices=('memory', 'sqlite'))
+    parser.add_argument('--latency-ms', type=float, help='Injected latency of every storage operation.')
+    parser.add_argument('--jitter', type=float)
+    parser.add_argument('--profile-calls', type=int)
+    parser.add_argument('--env', action='append', default=[], metavar='NAME=VALUE',
+                        help='Environment variable for the scenario process (repeatable).')
+    parser.add_argument('--run-scenario', metavar='RESULT_PATH', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.run_scenario:
+        # Child process: the scenario comes on stdin, the report goes to the file.
+        report = run_scenario(json.load(sys.stdin))
+        with open(args.run_scenario, 'w', encoding='utf-8') as output:
+            json.dump(report, output)
+        return 0
+
+    # Options given on the command line apply to every scenario, e.g. a shorter --duration.
+    overrides = {name: value for name, value in vars(args).items()
+                 if name in DEFAULT_SCENARIO and value is not None and name != 'env'}
+    if args.latency_ms is not None:
+        overrides['latency_ms'] = {'default': args.latency_ms}
+    env = {}
+    for setting in args.env:
+        name, separator, value = setting.partition('=')
+        if not separator:
+            parser.error(f"Invalid --env '{setting}', expected NAME=VALUE.")
+        env[name] = value
+    try:
+        scenarios = load_scenarios(args.scenarios) if args.scenarios else [make_scenario({})]
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    scenarios = [dict(scenario, **overrides, env=dict(scenario['env'], **env)) for scenario in scenarios]
+
+    reports = []
+    for scenario in scenarios:
+        print(f"Running '{scenario['name']}': {scenario['users']} users for {scenario['duration_seconds']:.0f}s...",
+              file=sys.stderr)
+        try:
+            reports.append(run_in_subprocess(scenario))
+        except subprocess.CalledProcessError as e:
+            print(f"Error: scenario '{scenario['name']}' failed with status {e.returncode}.", file=sys.stderr)
+            return 1
+    print_report(reports)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output:
+            json.dump(reports, output, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
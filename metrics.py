@@ -0,0 +1,309 @@
+# metrics.py
+"""
+Lightweight per-stage latency metrics.
+
+Wrap a stage with `timed('stage')`, as a context manager or a decorator. Every
+stage gets a fixed-bucket histogram with a count, error count and sum, which
+can be read as percentiles (summary()) or exported in Prometheus text format.
+
+Recording is meant to stay under a microsecond per call: `timed()` returns the
+stage's span from a dict after the first call, and a duration is only appended
+to a buffer. `python benchmark.py --suite metrics` measures it. On a 1-CPU VM
+with Python 3.11 a decorated call adds about 0.45 us and a `with timed()` block
+about 0.8 us; of that, an empty with statement alone takes 0.3 us and the two
+clock reads 0.2 us. Hot loops that need less can keep the start on the stack
+and call Histogram.observe() directly.
+"""
+
+import functools
+import os
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Upper bounds of the histogram buckets, in seconds.
+BUCKETS_SECONDS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Set METRICS_PORT to serve /metrics over HTTP and/or METRICS_FILE to have the
+# Prometheus text written to a file every METRICS_FILE_INTERVAL seconds.
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 0))
+METRICS_FILE = os.environ.get("METRICS_FILE", "")
+METRICS_FILE_INTERVAL_SECONDS = float(os.environ.get("METRICS_FILE_INTERVAL", 15))
+
+_perf_counter = time.perf_counter
+
+
+# Observations are buffered and folded into buckets in batches of this size.
+_FOLD_EVERY = 1024
+
+
+class Histogram:
+    """
+    Latency histogram of one stage.
+
+    Recording only appends to a buffer (atomic under the GIL, no lock), which
+    is folded into the buckets every _FOLD_EVERY observations and before reads.
+    The buffer is never replaced, only trimmed by the fold, so an append that
+    races a fold is kept for the next one. Errors are buffered as negative durations.
+    """
+    __slots__ = ('stage', 'counts', 'total', 'count', 'errors', '_pending', '_lock')
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        # One extra bucket for observations above the last bound (+Inf).
+        self.counts = [0] * (len(BUCKETS_SECONDS) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.errors = 0
+        self._pending = []
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float, error: bool = False):
+        pending = self._pending
+        pending.append(-seconds if error else seconds)
+        if len(pending) >= _FOLD_EVERY:
+            self._fold()
+
+    def _fold(self):
+        with self._lock:
+            # Copy, then remove exactly what was copied: appends made in between stay buffered.
+            pending = self._pending[:]
+            del self._pending[:len(pending)]
+            # Sorted, the batch is counted with one bisect per bucket bound instead of
+            # a Python loop per observation: errors (negative) first, then successes.
+            pending.sort()
+            errors = bisect_left(pending, 0.0)
+            size = len(pending)
+            below = 0
+            for index, bound in enumerate(BUCKETS_SECONDS):
+                # Observations <= bound: errors down to -bound and successes up to bound.
+                within = errors - bisect_left(pending, -bound, 0, errors) + bisect_right(pending, bound, errors) - errors
+                self.counts[index] += within - below
+                below = within
+            self.counts[-1] += size - below
+            self.total += sum(pending[errors:]) - sum(pending[:errors])
+            self.errors += errors
+            self.count += size
+
+    def reset(self):
+        with self._lock:
+            del self._pending[:]
+            self.counts = [0] * (len(BUCKETS_SECONDS) + 1)
+            self.total = 0.0
+            self.count = 0
+            self.errors = 0
+
+    def snapshot(self) -> tuple:
+        """
+        Returns (bucket counts, sum, count, errors) including buffered observations.
+        """
+        self._fold()
+        with self._lock:
+            return list(self.counts), self.total, self.count, self.errors
+
+    def quantile(self, q: float) -> float:
+        """
+        Estimates a quantile by interpolating inside the bucket that holds it.
+        Values in the +Inf bucket are reported as the last bound.
+        """
+        counts, _, count, _ = self.snapshot()
+        if not count:
+            return 0.0
+        rank = q * count
+        seen = 0
+        for index, bucket_count in enumerate(counts):
+            if seen + bucket_count >= rank and bucket_count:
+                if index == len(BUCKETS_SECONDS):
+                    return BUCKETS_SECONDS[-1]
+                lower = BUCKETS_SECONDS[index - 1] if index else 0.0
+                return lower + (BUCKETS_SECONDS[index] - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return BUCKETS_SECONDS[-1]
+
+
+_histograms = {}
+_registry_lock = threading.Lock()
+
+
+def histogram(stage: str) -> Histogram:
+    hist = _histograms.get(stage)
+    if hist is None:
+        with _registry_lock:
+            hist = _histograms.setdefault(stage, Histogram(stage))
+    return hist
+
+
+class _Starts(threading.local):
+    def __init__(self):
+        self.stack = []
+
+
+# Start times of the open `with` blocks of this thread, innermost last.
+_starts = _Starts()
+
+
+class _Span:
+    # One span per stage, shared by every thread: the start of a `with` block is
+    # kept on the thread's own stack, so spans nest and never need allocating.
+    # observe() is inlined below: recording a span is on every hot path.
+    __slots__ = ('_histogram', '_pending')
+
+    def __init__(self, hist: Histogram):
+        self._histogram = hist
+        # The buffer is never replaced, so it can be held on to.
+        self._pending = hist._pending
+
+    def __enter__(self):
+        _starts.stack.append(_perf_counter())
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = _perf_counter() - _starts.stack.pop()
+        pending = self._pending
+        pending.append(elapsed if exc_type is None else -elapsed)
+        if len(pending) >= _FOLD_EVERY:
+            self._histogram._fold()
+        return False
+
+    def __call__(self, fn):
+        hist = self._histogram
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = _perf_counter()
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException:
+                hist.observe(_perf_counter() - start, True)
+                raise
+            pending = hist._pending
+            pending.append(_perf_counter() - start)
+            if len(pending) >= _FOLD_EVERY:
+                hist._fold()
+            return result
+        return wrapper
+
+
+_spans = {}
+
+
+def timed(stage: str) -> _Span:
+    """
+    Times a stage. Use as `with timed('stage'):` or as `@timed('stage')`.
+    An exception leaving the block counts as an error for the stage.
+    """
+    span = _spans.get(stage)
+    if span is None:
+        span = _spans.setdefault(stage, _Span(histogram(stage)))
+    return span
+
+
+def summary() -> list:
+    """
+    Returns one row per stage with count, error rate, mean and p50/p95/p99 in milliseconds.
+    """
+    rows = []
+    for stage, hist in sorted(_histograms.items()):
+        _, total, count, errors = hist.snapshot()
+        rows.append({
+            'stage': stage,
+            'count': count,
+            'errors': errors,
+            'error_rate': errors / count if count else 0.0,
+            'mean_ms': total / count * 1000 if count else 0.0,
+            'p50_ms': hist.quantile(0.50) * 1000,
+            'p95_ms': hist.quantile(0.95) * 1000,
+            'p99_ms': hist.quantile(0.99) * 1000,
+        })
+    return rows
+
+
+def reset():
+    """
+    Zeroes every stage. The histograms are kept, so decorated functions and
+    spans created before the reset go on recording into them.
+    """
+    with _registry_lock:
+        histograms = list(_histograms.values())
+    for hist in histograms:
+        hist.reset()
+
+
+def render_prometheus() -> str:
+    """
+    Renders every stage histogram in the Prometheus text exposition format.
+    """
+    lines = [
+        '# HELP moodwave_stage_seconds Latency of each pipeline stage.',
+        '# TYPE moodwave_stage_seconds histogram',
+    ]
+    errors = [
+        '# HELP moodwave_stage_errors_total Calls of each pipeline stage that raised.',
+        '# TYPE moodwave_stage_errors_total counter',
+    ]
+    for stage, hist in sorted(_histograms.items()):
+        counts, total, count, failed = hist.snapshot()
+        label = stage.replace('\\', '\\\\').replace('"', '\\"')
+        cumulative = 0
+        for bound, bucket_count in zip(BUCKETS_SECONDS + (float('inf'),), counts):
+            cumulative += bucket_count
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            lines.append(f'moodwave_stage_seconds_bucket{{stage="{label}",le="{le}"}} {cumulative}')
+        lines.append(f'moodwave_stage_seconds_sum{{stage="{label}"}} {total}')
+        lines.append(f'moodwave_stage_seconds_count{{stage="{label}"}} {count}')
+        errors.append(f'moodwave_stage_errors_total{{stage="{label}"}} {failed}')
+    return '\n'.join(lines + errors) + '\n'
+
+
+def write_prometheus_file(path: str):
+    # Write then rename, so a scraper never reads a half-written file.
+    temporary = path + '.tmp'
+    with open(temporary, 'w', encoding='utf-8') as output:
+        output.write(render_prometheus())
+    os.replace(temporary, path)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip('/') != '/metrics':
+            self.send_error(404)
+            return
+        body = render_prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_exporters_started = False
+_exporters_lock = threading.Lock()
+
+
+def start_exporters(port: int = METRICS_PORT, path: str = METRICS_FILE,
+                    interval: float = METRICS_FILE_INTERVAL_SECONDS):
+    """
+    Starts the configured exporters once per process: an HTTP /metrics endpoint
+    on 127.0.0.1:`port` and/or a file rewritten every `interval` seconds.
+    """
+    global _exporters_started
+    with _exporters_lock:
+        if _exporters_started:
+            return
+        _exporters_started = True
+    if port:
+        server = ThreadingHTTPServer(('127.0.0.1', port), _MetricsHandler)
+        threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    if path:
+        def write_loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    write_prometheus_file(path)
+                except OSError as e:
+                    print(f"Could not write metrics to {path}: {e}")
+        threading.Thread(target=write_loop, name='metrics-file', daemon=True).start()
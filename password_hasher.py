@@ -0,0 +1,119 @@
+# password_hasher.py
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+import resources
+from metrics import timed
+
+# bcrypt work factor for new hashes. Stored hashes with a different cost are
+# re-hashed on the next successful login.
+BCRYPT_ROUNDS = int(os.environ.get("BCRYPT_ROUNDS", 12))
+# bcrypt releases the GIL while hashing, so a small thread pool runs hashes in
+# parallel without blocking the Streamlit script threads.
+BCRYPT_MAX_WORKERS = int(os.environ.get("BCRYPT_MAX_WORKERS", 2))
+# Hashes allowed to be queued or running at once, and how long a caller waits
+# for a free slot before giving up.
+BCRYPT_MAX_PENDING = int(os.environ.get("BCRYPT_MAX_PENDING", 32))
+BCRYPT_QUEUE_TIMEOUT_SECONDS = float(os.environ.get("BCRYPT_QUEUE_TIMEOUT", 10))
+
+
+class HasherBusyError(RuntimeError):
+    """
+    Raised when the hashing pool has no free slot within the queue timeout.
+    """
+
+
+class PasswordHasher:
+    """
+    Runs bcrypt hashing and verification on a bounded worker pool and keeps
+    queue-depth and timing metrics.
+    """
+
+    def __init__(self, rounds: int = BCRYPT_ROUNDS, max_workers: int = BCRYPT_MAX_WORKERS,
+                 max_pending: int = BCRYPT_MAX_PENDING, queue_timeout: float = BCRYPT_QUEUE_TIMEOUT_SECONDS):
+        self.rounds = rounds
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.queue_timeout = queue_timeout
+        self._executor = None
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._counts = {'submitted': 0, 'completed': 0, 'rejected': 0, 'queued': 0, 'running': 0,
+                        'max_queued': 0, 'wait_seconds': 0.0, 'run_seconds': 0.0}
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='bcrypt')
+        return self._executor
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            with self._lock:
+                self._counts['rejected'] += 1
+            raise HasherBusyError("Password hashing is busy. Please try again in a moment.")
+        submitted = time.perf_counter()
+        with self._lock:
+            self._counts['submitted'] += 1
+            self._counts['queued'] += 1
+            self._counts['max_queued'] = max(self._counts['max_queued'], self._counts['queued'])
+
+        def task():
+            started = time.perf_counter()
+            with self._lock:
+                self._counts['queued'] -= 1
+                self._counts['running'] += 1
+                self._counts['wait_seconds'] += started - submitted
+            try:
+                return fn(*args)
+            finally:
+                with self._lock:
+                    self._counts['running'] -= 1
+                    self._counts['completed'] += 1
+                    self._counts['run_seconds'] += time.perf_counter() - started
+                self._slots.release()
+
+        return self._get_executor().submit(task).result()
+
+    def hash(self, password: str) -> str:
+        """
+        Hashes a password with the configured cost factor.
+        """
+        salt = bcrypt.gensalt(rounds=self.rounds)
+        with timed('bcrypt.hash'):
+            return self._run(bcrypt.hashpw, password.encode('utf-8'), salt).decode('utf-8')
+
+    def verify(self, password: str, stored_hash: str) -> bool:
+        """
+        Checks a password against a stored bcrypt hash.
+        """
+        with timed('bcrypt.verify'):
+            return self._run(bcrypt.checkpw, password.encode('utf-8'), stored_hash.encode('utf-8'))
+
+    def needs_rehash(self, stored_hash: str) -> bool:
+        """
+        Tells whether a stored hash was made with a different cost factor.
+        """
+        try:
+            return int(stored_hash.split('$')[2]) != self.rounds
+        except (IndexError, ValueError):
+            return True
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._counts, workers=self.max_workers, max_pending=self.max_pending)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+
+
+password_hasher = PasswordHasher()
+# The pool's threads start on the first hash; warming up starts them ahead of time.
+resources.register('bcrypt_pool', lambda: password_hasher._get_executor())
@@ -0,0 +1,159 @@
+# resilience.py
+"""
+Deadlines, retries with jittered exponential backoff, and a circuit breaker
+for calls to a remote service.
+
+    breaker = CircuitBreaker('supabase')
+    rows = call(run_query, breaker=breaker, deadline=3.0, retries=2, retry_on=(httpx.TransportError,))
+"""
+
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+import resources
+
+# Threads that run calls with a deadline. A call that misses its deadline is
+# abandoned, not killed, so it keeps its thread until the request itself ends.
+CALL_THREADS = int(os.environ.get("RESILIENCE_CALL_THREADS", 32))
+RETRY_BASE_DELAY_SECONDS = 0.05
+RETRY_MAX_DELAY_SECONDS = 1.0
+
+
+class DeadlineExceededError(TimeoutError):
+    """
+    Raised when a call (including its retries) does not finish within its deadline.
+    """
+
+
+class CircuitOpenError(RuntimeError):
+    """
+    Raised without calling the service while its circuit breaker is open.
+    """
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures and then rejects calls
+    for `reset_seconds`. After that a single trial call is let through
+    (half-open): its success closes the breaker, its failure opens it again.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_seconds: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+        self._counts = {'calls': 0, 'failures': 0, 'rejected': 0, 'opened': 0}
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_seconds:
+                self._state = self.HALF_OPEN
+                self._trial_running = False
+            if self._state == self.CLOSED or (self._state == self.HALF_OPEN and not self._trial_running):
+                self._trial_running = self._state == self.HALF_OPEN
+                self._counts['calls'] += 1
+                return True
+            self._counts['rejected'] += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._counts['failures'] += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    self._counts['opened'] += 1
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._trial_running = False
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._counts, name=self.name, state=self._state, consecutive_failures=self._failures)
+
+
+resources.register('resilience_call_pool',
+                   lambda: ThreadPoolExecutor(max_workers=CALL_THREADS, thread_name_prefix='deadline-call'))
+
+
+def _run_with_deadline(fn, timeout: float):
+    future = resources.get('resilience_call_pool').submit(fn)
+    try:
+        return future.result(timeout=timeout)
+    except FutureTimeoutError:
+        future.cancel()
+        raise DeadlineExceededError("The call did not finish within its deadline.") from None
+
+
+def call(fn, breaker: CircuitBreaker = None, deadline: float = None, retries: int = 0,
+         retry_on: tuple = (), base_delay: float = RETRY_BASE_DELAY_SECONDS,
+         max_delay: float = RETRY_MAX_DELAY_SECONDS):
+    """
+    Calls fn() under an overall deadline, retrying on `retry_on` errors.
+    :param breaker: Breaker to consult before each attempt and to report to.
+                    Only `retry_on` errors and missed deadlines count as failures;
+                    any other exception means the service answered.
+    :param deadline: Seconds for all attempts together, or None for no limit.
+    :param retries: Extra attempts after a `retry_on` error. Only use them for
+                    calls that are safe to repeat.
+    :raises CircuitOpenError: If the breaker rejects the call.
+    :raises DeadlineExceededError: If the deadline runs out.
+    """
+    deadline_at = time.monotonic() + deadline if deadline is not None else None
+    attempt = 0
+    while True:
+        if breaker is not None and not breaker.allow():
+            raise CircuitOpenError(f"'{breaker.name}' is unavailable, not calling it for now.")
+        try:
+            if deadline_at is None:
+                result = fn()
+            else:
+                remaining = deadline_at - time.monotonic()
+                if remaining <= 0:
+                    raise DeadlineExceededError("The call did not finish within its deadline.")
+                result = _run_with_deadline(fn, remaining)
+        except DeadlineExceededError:
+            if breaker is not None:
+                breaker.record_failure()
+            raise
+        except retry_on:
+            if breaker is not None:
+                breaker.record_failure()
+            if attempt >= retries:
+                raise
+            # Full jitter: a random delay up to the exponential cap, so that
+            # clients failing together do not retry together.
+            delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+            if deadline_at is not None and time.monotonic() + delay >= deadline_at:
+                raise
+            time.sleep(delay)
+            attempt += 1
+            continue
+        except Exception:
+            if breaker is not None:
+                breaker.record_success()
+            raise
+        if breaker is not None:
+            breaker.record_success()
+        return result
@@ -0,0 +1,136 @@
+# resources.py
+"""
+Registry of the process-wide resources that are expensive to create: the
+database client, the storage backend, the NLP models and the bcrypt pool.
+
+Modules register a factory at import time, which costs nothing; the resource is
+built on the first get() and shared by every later caller. warm_up() builds
+them ahead of the first request, in the background if asked to.
+"""
+
+import os
+import threading
+import time
+
+_factories = {}
+_instances = {}
+_init_seconds = {}
+_name_locks = {}
+_lock = threading.Lock()
+_environment_loaded = False
+_configured_warm_up_started = False
+
+
+def load_environment():
+    """
+    Loads the .env file into os.environ, once per process. Entry points call it
+    before importing modules that read their settings at import time.
+    """
+    global _environment_loaded
+    if _environment_loaded:
+        return
+    from dotenv import load_dotenv
+    load_dotenv()
+    _environment_loaded = True
+
+
+def register(name: str, factory):
+    """
+    Registers a zero-argument factory for a lazily created resource.
+    """
+    with _lock:
+        _factories[name] = factory
+
+
+def get(name: str):
+    """
+    Returns the resource, creating it on first use. A factory that raises is
+    tried again on the next call.
+    """
+    try:
+        return _instances[name]
+    except KeyError:
+        pass
+    with _lock:
+        if name not in _factories:
+            raise KeyError(f"No resource named '{name}' is registered.")
+        name_lock = _name_locks.setdefault(name, threading.Lock())
+    # One lock per resource, so a slow factory does not hold up the others.
+    with name_lock:
+        if name not in _instances:
+            started = time.perf_counter()
+            instance = _factories[name]()
+            with _lock:
+                _instances[name] = instance
+                _init_seconds[name] = time.perf_counter() - started
+        return _instances[name]
+
+
+def replace(name: str, instance):
+    """
+    Replaces a resource, e.g. with a stand-in for benchmarks.
+    """
+    with _lock:
+        _instances[name] = instance
+
+
+def reset(name: str):
+    """
+    Drops a created resource so the next get() builds it again.
+    """
+    with _lock:
+        _instances.pop(name, None)
+        _init_seconds.pop(name, None)
+
+
+def is_initialized(name: str) -> bool:
+    return name in _instances
+
+
+def warm_up(names=None, background: bool = False):
+    """
+    Creates the named resources (all registered ones by default) now instead
+    of on first use. Failures are printed, not raised: the resource is simply
+    created, or fails again, on its first real use.
+    """
+    if names is None:
+        names = list(_factories)
+
+    def run():
+        for name in names:
+            try:
+                get(name)
+            except Exception as e:
+                print(f"Could not warm up resource '{name}': {e}")
+
+    if background:
+        threading.Thread(target=run, name='resource-warm-up', daemon=True).start()
+    else:
+        run()
+
+
+def warm_up_configured(background: bool = True):
+    """
+    Warms up the resources listed in the WARM_UP_RESOURCES environment variable
+    (comma-separated, or 'all'), if any. Read at call time, after load_environment().
+    Only the first call in a process does anything, so scripts that rerun can call it freely.
+    """
+    global _configured_warm_up_started
+    with _lock:
+        if _configured_warm_up_started:
+            return
+        _configured_warm_up_started = True
+    configured = os.environ.get("WARM_UP_RESOURCES", "").strip()
+    if not configured:
+        return
+    names = None if configured == 'all' else [name.strip() for name in configured.split(',') if name.strip()]
+    warm_up(names, background)
+
+
+def stats() -> dict:
+    """
+    Reports every registered resource and how long it took to create, if it has been.
+    """
+    with _lock:
+        return {name: {'initialized': name in _instances, 'init_seconds': _init_seconds.get(name)}
+                for name in _factories}
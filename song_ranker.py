@@ -0,0 +1,241 @@
+# song_ranker.py
+"""
+Top-k song ranking against emotion score vectors.
+
+Every song gets a vector over EMOTIONS: its stored mood, blended with what the
+analyzer reads from its title. The vectors are saved as an (emotions x songs)
+float32 matrix that is memory-mapped on load, so all worker processes share
+the same pages. A query is ranked with one matrix-vector product and
+argpartition, optionally re-ranked for diversity:
+
+    python song_ranker.py build               # writes SONG_INDEX_DIR from the catalog
+    python song_ranker.py query "sad but calm" --k 5 --diversity 0.3
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import threading
+import time
+from typing import Optional
+
+import numpy as np
+
+import resources
+
+# Settings are read at import time by this and the service modules, so .env goes first.
+resources.load_environment()
+
+from emotion_analyzer import EMOTIONS, analyze_emotions
+from metrics import timed
+from song_recommender import CATALOG_PAGE_SIZE, catalog
+from storage import get_storage
+
+SONG_INDEX_DIR = os.environ.get("SONG_INDEX_DIR", "song_index")
+# Share of a song's vector that comes from its stored mood; the rest comes from
+# analyzing its title.
+MOOD_WEIGHT = 0.7
+# Diversity re-ranking picks from this many times k of the best candidates.
+CANDIDATE_FACTOR = 10
+
+_VECTORS_FILE = 'vectors.npy'
+_IDS_FILE = 'ids.npy'
+_MOODS_FILE = 'moods.npy'
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    # Unit length along the emotion axis, so a dot product is a cosine similarity.
+    norms = np.linalg.norm(vectors, axis=0, keepdims=True)
+    return vectors / np.where(norms > 0, norms, 1)
+
+
+def song_vectors(rows: list) -> tuple:
+    """
+    Computes the vectors of a page of songs.
+    :return: An (emotions x songs) float32 matrix and the mood index of each
+             song (-1 for moods outside EMOTIONS).
+    """
+    moods = np.array([EMOTIONS.index(row['mood']) if row['mood'] in EMOTIONS else -1 for row in rows],
+                     dtype=np.int8)
+    title_scores = analyze_emotions([row['song_title'] for row in rows]).scores.T
+    vectors = (1 - MOOD_WEIGHT) * title_scores
+    tagged = np.flatnonzero(moods >= 0)
+    vectors[moods[tagged], tagged] += MOOD_WEIGHT
+    return _normalize(vectors).astype(np.float32), moods
+
+
+def query_vector(text: str) -> np.ndarray:
+    """
+    The emotion vector of a user's text: the analyzer's scores over EMOTIONS.
+    """
+    return _normalize(analyze_emotions([text]).scores[0][:, None])[:, 0].astype(np.float32)
+
+
+def build_index(path: str = SONG_INDEX_DIR, page_size: int = CATALOG_PAGE_SIZE) -> int:
+    """
+    Computes the vectors of every song in storage and writes the index
+    directory. The new index replaces the old one only once it is complete.
+    :return: The number of songs indexed.
+    """
+    vector_pages, id_pages, mood_pages = [], [], []
+    offset = 0
+    while True:
+        rows = get_storage().fetch_songs(offset=offset, limit=page_size)
+        if rows:
+            vectors, moods = song_vectors(rows)
+            vector_pages.append(vectors)
+            mood_pages.append(moods)
+            id_pages.append(np.array([row['id'] for row in rows], dtype=np.int64))
+        if len(rows) < page_size:
+            break
+        offset += page_size
+
+    staging = path + '.tmp'
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    empty = np.zeros((len(EMOTIONS), 0), dtype=np.float32)
+    np.save(os.path.join(staging, _VECTORS_FILE), np.hstack(vector_pages) if vector_pages else empty)
+    np.save(os.path.join(staging, _IDS_FILE), np.concatenate(id_pages) if id_pages else np.zeros(0, np.int64))
+    np.save(os.path.join(staging, _MOODS_FILE), np.concatenate(mood_pages) if mood_pages else np.zeros(0, np.int8))
+    previous = path + '.old'
+    shutil.rmtree(previous, ignore_errors=True)
+    if os.path.exists(path):
+        os.rename(path, previous)
+    os.rename(staging, path)
+    shutil.rmtree(previous, ignore_errors=True)
+    return sum(len(ids) for ids in id_pages)
+
+
+class SongIndex:
+    """
+    Memory-mapped song vectors with top-k ranking.
+    """
+
+    def __init__(self, vectors: np.ndarray, ids: np.ndarray, moods: np.ndarray):
+        self.vectors = vectors
+        self.ids = ids
+        self.moods = moods
+
+    @classmethod
+    def load(cls, path: str = SONG_INDEX_DIR) -> 'SongIndex':
+        def load_array(name):
+            return np.load(os.path.join(path, name), mmap_mode='r')
+        return cls(load_array(_VECTORS_FILE), load_array(_IDS_FILE), load_array(_MOODS_FILE))
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @timed('songs.rank')
+    def rank(self, query: np.ndarray, k: int = 10, diversity: float = 0.0, exclude=()) -> list:
+        """
+        Ranks the catalog against a query vector.
+        :param k: Number of songs to return.
+        :param diversity: 0 ranks purely by similarity; up to 1 trades similarity
+                          for songs unlike the ones already picked (MMR).
+        :param exclude: Song ids that must not be returned.
+        :return: (song_id, mood, score) tuples, best first.
+        """
+        if not len(self) or k <= 0:
+            return []
+        exclude = np.fromiter(exclude, dtype=np.int64)
+        scores = query @ self.vectors
+        pool = k * CANDIDATE_FACTOR if diversity > 0 or exclude.size else k
+        if pool < len(scores):
+            candidates = np.argpartition(scores, len(scores) - pool)[-pool:]
+        else:
+            candidates = np.arange(len(scores))
+        if exclude.size:
+            candidates = candidates[~np.isin(self.ids[candidates], exclude)]
+        candidates = candidates[np.argsort(-scores[candidates], kind='stable')]
+        if diversity > 0:
+            candidates = self._diversify(candidates, scores[candidates], k, diversity)
+        return [(int(self.ids[i]), EMOTIONS[self.moods[i]] if self.moods[i] >= 0 else None, float(scores[i]))
+                for i in candidates[:k]]
+
+    def _diversify(self, candidates: np.ndarray, relevance: np.ndarray, k: int, diversity: float) -> np.ndarray:
+        vectors = np.asarray(self.vectors[:, candidates])
+        max_similarity = np.zeros(len(candidates), dtype=np.float32)
+        available = np.ones(len(candidates), dtype=bool)
+        picked = []
+        for _ in range(min(k, len(candidates))):
+            marginal = np.where(available, (1 - diversity) * relevance - diversity * max_similarity, -np.inf)
+            best = int(np.argmax(marginal))
+            picked.append(best)
+            available[best] = False
+            np.maximum(max_similarity, vectors[:, best] @ vectors, out=max_similarity)
+        return candidates[picked]
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_song_index() -> Optional[SongIndex]:
+    """
+    Returns the process-wide index loaded from SONG_INDEX_DIR, or None if it
+    has not been built.
+    """
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None and os.path.exists(os.path.join(SONG_INDEX_DIR, _VECTORS_FILE)):
+                _index = SongIndex.load(SONG_INDEX_DIR)
+    return _index
+
+
+def get_ranked_songs(text: str, k: int = 10, diversity: float = 0.0, exclude=(),
+                     query: Optional[np.ndarray] = None) -> list:
+    """
+    Recommends the k songs whose emotion vectors best match the text, so mixed
+    feelings get a blend of moods rather than a single bucket.
+    :param query: query_vector(text), if it was already computed (e.g. in another process).
+    :return: Song dicts (as from get_song_recommender) with an added 'score',
+             or an empty list if there is no index.
+    """
+    index = get_song_index()
+    if index is None:
+        return []
+    songs = []
+    try:
+        if query is None:
+            query = query_vector(text)
+        for song_id, mood, score in index.rank(query, k, diversity, exclude):
+            # Details come from the song catalog; loading a mood's partition is a no-op once cached.
+            if mood is not None:
+                catalog.get_partition(mood)
+            song = catalog.find_song(song_id)
+            if song is not None:
+                songs.append(dict(song, score=score))
+    except Exception as e:
+        print(f"An error occurred while ranking songs: {e}")
+    return songs
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Build or query the song ranking index.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help='Compute the vectors of every song in storage.')
+    build.add_argument('--index-dir', default=SONG_INDEX_DIR)
+    query = commands.add_parser('query', help='Rank the catalog for a text.')
+    query.add_argument('text')
+    query.add_argument('--k', type=int, default=10)
+    query.add_argument('--diversity', type=float, default=0.0)
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        started = time.perf_counter()
+        count = build_index(args.index_dir)
+        print(f"Indexed {count} songs into {args.index_dir} in {time.perf_counter() - started:.1f}s.")
+        return 0
+    songs = get_ranked_songs(args.text, args.k, args.diversity)
+    if not songs:
+        print("No songs ranked. Build the index first: python song_ranker.py build")
+        return 1
+    for song in songs:
+        print(f"{song['score']:.3f}  {song['mood']:<8}  {song['song_title']} - {song['artists']}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
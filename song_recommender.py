@@ -1,20 +1,469 @@
+import itertools
+import json
+import os
 import random
-from supabase_client import supabase
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from metrics import timed
+from storage import get_storage
 from typing import Optional  # <-- Add this import
 
-def get_song_recommender(mood: str) -> Optional[dict]:
+CATALOG_PAGE_SIZE = 1000
+# A partition older than the TTL is reloaded in full (this is what picks up deletions);
+# a partition nobody has read for a TTL is evicted from memory.
+CATALOG_TTL_SECONDS = float(os.environ.get("SONG_CATALOG_TTL_SECONDS", 900))
+CATALOG_REFRESH_SECONDS = float(os.environ.get("SONG_CATALOG_REFRESH_SECONDS", 60))
+# Column used for modified-since refreshes. On Supabase it is created by
+# sql/003_newsongs_updated_at.sql. Set it to an empty string if `newsongs` has no
+# such column; the catalog then relies on TTL reloads alone.
+CATALOG_WATERMARK_COLUMN = os.environ.get("SONG_CATALOG_WATERMARK_COLUMN", "updated_at")
+# Per-user rotation limits: how many users are tracked, how many songs a deck deals
+# before it reshuffles (this bounds memory per deck), and how much history seeds it.
+ROTATION_MAX_USERS = int(os.environ.get("SONG_ROTATION_MAX_USERS", 1024))
+ROTATION_SPAN = int(os.environ.get("SONG_ROTATION_SPAN", 256))
+ROTATION_HISTORY_SEED = int(os.environ.get("SONG_ROTATION_HISTORY_SEED", 50))
+# Optional directory for a last-known-good copy of each loaded partition. It is
+# served when a partition cannot be loaded from the database, e.g. right after a
+# restart during an outage. Loaded partitions are kept as they are regardless.
+CATALOG_SNAPSHOT_DIR = os.environ.get("SONG_CATALOG_SNAPSHOT_DIR", "")
+
+
+class _MoodPartition:
+    """
+    The songs of a single mood, stored as parallel arrays so that picking a
+    song is an index lookup.
+    """
+    __slots__ = ('mood', 'ids', 'titles', 'artists', 'links', 'positions',
+                 'loaded_at', 'last_read', 'generation', 'stale')
+
+    def __init__(self, mood: str, rows: list, generation: int):
+        self.mood = mood
+        self.ids = []
+        self.titles = []
+        self.artists = []
+        self.links = []
+        self.positions = {}
+        self.loaded_at = self.last_read = time.monotonic()
+        # Changes whenever existing positions move, so index-based consumers can tell.
+        self.generation = generation
+        # True while this is a last-known-good copy that could not be refreshed.
+        self.stale = False
+        for row in rows:
+            self.upsert(row)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def upsert(self, row: dict):
+        position = self.positions.get(row['id'])
+        if position is None:
+            self.positions[row['id']] = len(self.ids)
+            self.ids.append(row['id'])
+            self.titles.append(row['song_title'])
+            self.artists.append(row['artists'])
+            self.links.append(row['link'])
+        else:
+            self.titles[position] = row['song_title']
+            self.artists[position] = row['artists']
+            self.links[position] = row['link']
+
+    def remove(self, song_id):
+        position = self.positions.pop(song_id, None)
+        if position is None:
+            return
+        # Swap-remove keeps the arrays dense at the cost of moving the last song.
+        last = len(self.ids) - 1
+        if position != last:
+            self.ids[position] = self.ids[last]
+            self.titles[position] = self.titles[last]
+            self.artists[position] = self.artists[last]
+            self.links[position] = self.links[last]
+            self.positions[self.ids[position]] = position
+        for column in (self.ids, self.titles, self.artists, self.links):
+            column.pop()
+
+    def song_at(self, position: int) -> dict:
+        return {
+            'id': self.ids[position],
+            'song_title': self.titles[position],
+            'artists': self.artists[position],
+            'link': self.links[position],
+            'mood': self.mood,
+        }
+
+
+class SongCatalog:
+    """
+    Process-wide snapshot of the `newsongs` table, partitioned by mood.
+
+    The first request for a mood loads that partition; after that a background
+    thread keeps it fresh with modified-since queries and reloads or evicts it
+    once its TTL has passed, so recommendations are served from memory.
+    """
+
+    def __init__(self, ttl: float = CATALOG_TTL_SECONDS,
+                 refresh_interval: float = CATALOG_REFRESH_SECONDS,
+                 watermark_column: str = CATALOG_WATERMARK_COLUMN,
+                 snapshot_dir: str = CATALOG_SNAPSHOT_DIR):
+        self.ttl = ttl
+        self.refresh_interval = refresh_interval
+        self.watermark_column = watermark_column
+        self.snapshot_dir = snapshot_dir
+        self._lock = threading.RLock()
+        self._partitions = {}
+        self._song_moods = {}
+        self._watermark = None
+        self._generations = itertools.count()
+        self._refresher = None
+        self._stop = threading.Event()
+
+    # --- Reads ---
+
+    def get_partition(self, mood: str) -> _MoodPartition:
+        with self._lock:
+            partition = self._partitions.get(mood)
+        if partition is None:
+            partition = self._load_partition(mood)
+        partition.last_read = time.monotonic()
+        self._ensure_refresher()
+        return partition
+
+    def random_song(self, mood: str) -> Optional[dict]:
+        partition = self.get_partition(mood)
+        with self._lock:
+            if not len(partition):
+                return None
+            return partition.song_at(random.randrange(len(partition)))
+
+    def find_song(self, song_id) -> Optional[dict]:
+        """
+        Returns a cached song by id, or None if its mood is not loaded.
+        """
+        with self._lock:
+            mood = self._song_moods.get(song_id)
+            partition = self._partitions.get(mood)
+            if partition is None or song_id not in partition.positions:
+                return None
+            return partition.song_at(partition.positions[song_id])
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'moods': {mood: len(p) for mood, p in self._partitions.items()},
+                'songs': sum(len(p) for p in self._partitions.values()),
+                'stale': sorted(mood for mood, p in self._partitions.items() if p.stale),
+                'watermark': self._watermark,
+            }
+
+    # --- Loading and refreshing ---
+
+    def _fetch_pages(self, mood: Optional[str] = None, modified_since: Optional[str] = None) -> list:
+        rows = []
+        start = 0
+        while True:
+            page = get_storage().fetch_songs(mood=mood, modified_since=modified_since,
+                                             watermark_column=self.watermark_column or None,
+                                             offset=start, limit=CATALOG_PAGE_SIZE)
+            rows.extend(page)
+            if len(page) < CATALOG_PAGE_SIZE:
+                return rows
+            start += CATALOG_PAGE_SIZE
+
+    @timed('songs.load_partition')
+    def _load_partition(self, mood: str) -> _MoodPartition:
+        try:
+            rows = self._fetch_pages(mood=mood)
+        except Exception as e:
+            partition = self._last_known_good(mood)
+            if partition is None:
+                raise
+            print(f"Serving the last known songs for mood '{mood}': {e}")
+            return partition
+        self._save_snapshot(mood, rows)
+        with self._lock:
+            previous = self._partitions.get(mood)
+            partition = _MoodPartition(mood, rows, next(self._generations))
+            if previous is not None and previous.ids == partition.ids:
+                # Same songs at the same positions: decks dealt from the old copy stay valid.
+                partition.generation = previous.generation
+            if previous is not None:
+                for song_id in previous.ids:
+                    if self._song_moods.get(song_id) == mood:
+                        del self._song_moods[song_id]
+            for song_id in partition.ids:
+                self._song_moods[song_id] = mood
+            self._partitions[mood] = partition
+            # Later loads must not advance the watermark: that could skip changes
+            # to partitions that were loaded earlier.
+            if self._watermark is None and self.watermark_column:
+                marks = [row[self.watermark_column] for row in rows if row.get(self.watermark_column)]
+                if marks:
+                    self._watermark = max(marks)
+        return partition
+
+    def _snapshot_path(self, mood: str) -> str:
+        return os.path.join(self.snapshot_dir, f'songs-{mood}.json')
+
+    def _save_snapshot(self, mood: str, rows: list):
+        if not self.snapshot_dir:
+            return
+        path = self._snapshot_path(mood)
+        try:
+            os.makedirs(self.snapshot_dir, exist_ok=True)
+            with open(path + '.tmp', 'w', encoding='utf-8') as snapshot:
+                json.dump(rows, snapshot)
+            os.replace(path + '.tmp', path)
+        except OSError as e:
+            print(f"Could not write the song snapshot {path}: {e}")
+
+    def _last_known_good(self, mood: str) -> Optional[_MoodPartition]:
+        """
+        Returns the partition to serve when loading it failed: the one in memory,
+        or else the snapshot on disk. Either is marked stale and expired, so the
+        refresher keeps trying to reload it.
+        """
+        with self._lock:
+            partition = self._partitions.get(mood)
+        if partition is None and self.snapshot_dir:
+            try:
+                with open(self._snapshot_path(mood), encoding='utf-8') as snapshot:
+                    rows = json.load(snapshot)
+            except (OSError, ValueError):
+                return None
+            with self._lock:
+                partition = self._partitions.setdefault(mood, _MoodPartition(mood, rows, next(self._generations)))
+                for song_id in partition.ids:
+                    self._song_moods.setdefault(song_id, mood)
+        if partition is not None:
+            partition.stale = True
+            partition.loaded_at = time.monotonic() - self.ttl
+        return partition
+
+    def _apply_changes(self, rows: list):
+        with self._lock:
+            for row in rows:
+                old_mood = self._song_moods.get(row['id'])
+                if old_mood is not None and old_mood != row['mood']:
+                    self._partitions[old_mood].remove(row['id'])
+                    self._partitions[old_mood].generation = next(self._generations)
+                    del self._song_moods[row['id']]
+                partition = self._partitions.get(row['mood'])
+                if partition is not None:
+                    partition.upsert(row)
+                    self._song_moods[row['id']] = row['mood']
+                mark = row.get(self.watermark_column)
+                if mark and (self._watermark is None or mark > self._watermark):
+                    self._watermark = mark
+
+    @timed('songs.refresh')
+    def refresh(self):
+        """
+        Runs one refresh cycle: evicts idle partitions, reloads expired ones and
+        applies rows modified since the last watermark to the rest.
+        """
+        now = time.monotonic()
+        with self._lock:
+            partitions = list(self._partitions.values())
+        for partition in partitions:
+            if now - partition.last_read > self.ttl:
+                self.evict(partition.mood)
+            elif now - partition.loaded_at > self.ttl:
+                self._load_partition(partition.mood)
+
+        with self._lock:
+            watermark = self._watermark
+            has_partitions = bool(self._partitions)
+        if not self.watermark_column or watermark is None or not has_partitions:
+            return
+        rows = self._fetch_pages(modified_since=watermark)
+        self._apply_changes(rows)
+
+    def evict(self, mood: str):
+        with self._lock:
+            partition = self._partitions.pop(mood, None)
+            if partition is None:
+                return
+            for song_id in partition.ids:
+                if self._song_moods.get(song_id) == mood:
+                    del self._song_moods[song_id]
+
+    def _ensure_refresher(self):
+        if self._refresher is not None or self.refresh_interval <= 0:
+            return
+        with self._lock:
+            if self._refresher is None:
+                self._refresher = threading.Thread(target=self._refresh_loop, name='song-catalog-refresh', daemon=True)
+                self._refresher.start()
+
+    def _refresh_loop(self):
+        while not self._stop.wait(self.refresh_interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"An error occurred while refreshing the song catalog: {e}")
+
+    def close(self):
+        self._stop.set()
+
+
+class _ShuffledDeck:
+    """
+    A lazily shuffled permutation of partition positions with a cursor.
+
+    Only positions that have been swapped are stored (a sparse Fisher-Yates
+    shuffle), so dealing is O(1) and memory grows with the songs dealt, not
+    with the size of the partition.
     """
-    Fetches a random song from the Supabase database based on the detected mood.
+    __slots__ = ('size', 'generation', 'cursor', 'last', '_slots', '_where')
+
+    def __init__(self, size: int, generation: int):
+        self.size = size
+        self.generation = generation
+        self.cursor = 0
+        self.last = None
+        self._slots = {}
+        self._where = {}
+
+    def _at(self, slot: int) -> int:
+        return self._slots.get(slot, slot)
+
+    def _swap(self, i: int, j: int):
+        a, b = self._at(i), self._at(j)
+        self._slots[i], self._slots[j] = b, a
+        self._where[b], self._where[a] = i, j
+
+    def discard(self, position: int):
+        """
+        Moves a partition position into the dealt part of the deck.
+        """
+        slot = self._where.get(position, position)
+        if self.cursor <= slot < self.size:
+            self._swap(self.cursor, slot)
+            self.cursor += 1
+
+    def deal(self, span: int) -> int:
+        if self.cursor >= min(self.size, span):
+            # Start a new round, but never repeat the song that ended the last one.
+            self.cursor = 0
+            self._slots.clear()
+            self._where.clear()
+            if self.last is not None and self.size > 1:
+                self.discard(self.last)
+        self._swap(self.cursor, random.randrange(self.cursor, self.size))
+        self.last = self._at(self.cursor)
+        self.cursor += 1
+        return self.last
+
+    def entries(self) -> int:
+        return len(self._slots) + len(self._where)
+
+    def nbytes(self) -> int:
+        return sys.getsizeof(self) + sys.getsizeof(self._slots) + sys.getsizeof(self._where)
+
+
+class SongRotation:
+    """
+    Per-user, per-mood "shuffled deck" over the song catalog, so a user does
+    not hear the same song again until the deck (or its span) runs out.
+
+    Users are kept in a bounded LRU. The first pick for a user in this process
+    reads their recent recommendations once and marks those songs as dealt.
+    Songs dealt since then are remembered too (up to history_seed + span), so a
+    deck rebuilt after the partition changed does not deal them again.
+    """
+
+    def __init__(self, song_catalog: SongCatalog, max_users: int = ROTATION_MAX_USERS,
+                 span: int = ROTATION_SPAN, history_seed: int = ROTATION_HISTORY_SEED):
+        self.catalog = song_catalog
+        self.max_users = max_users
+        self.span = span
+        self.history_seed = history_seed
+        self._users = OrderedDict()
+
+    def _recent_song_ids(self, user_id) -> list:
+        if self.history_seed <= 0:
+            return []
+        try:
+            return get_storage().fetch_recent_song_ids(user_id, self.history_seed)
+        except Exception as e:
+            print(f"An error occurred while reading recent songs: {e}")
+            return []
+
+    def _user_entry(self, user_id) -> dict:
+        with self.catalog._lock:
+            entry = self._users.get(user_id)
+            if entry is not None:
+                self._users.move_to_end(user_id)
+                return entry
+        recent = self._recent_song_ids(user_id)
+        with self.catalog._lock:
+            entry = self._users.setdefault(
+                user_id, {'seen': deque(recent, maxlen=self.history_seed + self.span), 'decks': {}})
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+            return entry
+
+    def next_song(self, user_id, mood: str) -> Optional[dict]:
+        entry = self._user_entry(user_id)
+        partition = self.catalog.get_partition(mood)
+        with self.catalog._lock:
+            if not len(partition):
+                return None
+            deck = entry['decks'].get(mood)
+            if deck is None or deck.generation != partition.generation:
+                deck = _ShuffledDeck(len(partition), partition.generation)
+                for song_id in entry['seen']:
+                    position = partition.positions.get(song_id)
+                    if position is not None:
+                        deck.discard(position)
+                entry['decks'][mood] = deck
+            else:
+                # Songs appended by a refresh join the undealt part of the deck.
+                deck.size = len(partition)
+            song = partition.song_at(deck.deal(self.span))
+            entry['seen'].append(song['id'])
+            return song
+
+    def forget(self, user_id):
+        with self.catalog._lock:
+            self._users.pop(user_id, None)
+
+    def memory_stats(self) -> dict:
+        """
+        Reports how many users and decks are held and roughly how much memory they use.
+        """
+        with self.catalog._lock:
+            decks = [deck for entry in self._users.values() for deck in entry['decks'].values()]
+            seen = sum(len(entry['seen']) for entry in self._users.values())
+            return {
+                'users': len(self._users),
+                'decks': len(decks),
+                'deck_entries': sum(deck.entries() for deck in decks),
+                'seeded_songs': seen,
+                'approx_bytes': sum(deck.nbytes() for deck in decks) + seen * sys.getsizeof(0),
+            }
+
+
+catalog = SongCatalog()
+rotation = SongRotation(catalog)
+
+
+@timed('songs.recommend')
+def get_song_recommender(mood: str, user_id=None) -> Optional[dict]:
+    """
+    Picks a song for the detected mood from the in-memory song catalog.
+    Logged-in users get songs from their own rotation, so picks do not repeat.
     :param mood: The mood to filter songs by.
+    :param user_id: Optional ID of the logged-in user.
     :return: A dictionary containing song details or None if no songs are found.
     """
     try:
-        response = supabase.table('newsongs').select('*').eq('mood', mood).execute()
-        
-        if response.data and len(response.data) > 0:
-            return random.choice(response.data)
-        else:
-            return None
+        if user_id is not None:
+            return rotation.next_song(user_id, mood)
+        return catalog.random_song(mood)
     except Exception as e:
         print(f"An error occurred while fetching a song: {e}")
-        return None
\ No newline at end of file
+        return None
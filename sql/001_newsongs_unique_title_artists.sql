@@ -0,0 +1,9 @@
+-- Unique key used by the catalog import (import_songs.py) to upsert songs.
+-- Creating the index fails while duplicates exist; list them with:
+--
+--   select song_title, artists, array_agg(id order by id)
+--   from newsongs group by song_title, artists having count(*) > 1;
+--
+-- and merge them by hand (user_recommendations.song_id may point at any of them).
+
+create unique index if not exists newsongs_title_artists on newsongs (song_title, artists);
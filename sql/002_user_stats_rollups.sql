@@ -0,0 +1,63 @@
+-- Per-user rollups of user_recommendations, kept up to date by the interaction
+-- writer (increment_user_stats) and rebuilt by `python user_stats.py backfill`.
+
+create table if not exists user_mood_counts (
+    user_id bigint not null,
+    mood text not null,
+    count bigint not null,
+    primary key (user_id, mood)
+);
+
+create table if not exists user_mood_days (
+    user_id bigint not null,
+    day date not null,
+    mood text not null,
+    count bigint not null,
+    primary key (user_id, day, mood)
+);
+
+create table if not exists user_artist_counts (
+    user_id bigint not null,
+    artists text not null,
+    count bigint not null,
+    primary key (user_id, artists)
+);
+
+create index if not exists user_artist_counts_top on user_artist_counts (user_id, count desc);
+
+-- interactions: [{"user_id", "song_id", "detected_mood", "timestamp"}, ...]
+create or replace function increment_user_stats(interactions jsonb)
+returns void
+language sql
+as $$
+    with rows as (
+        select (r->>'user_id')::bigint as user_id,
+               (r->>'song_id')::bigint as song_id,
+               r->>'detected_mood' as mood,
+               coalesce((r->>'timestamp')::timestamptz, now()) at time zone 'utc' as logged_at
+        from jsonb_array_elements(interactions) as r
+    ),
+    moods as (
+        insert into user_mood_counts (user_id, mood, count)
+        select user_id, mood, count(*) from rows group by user_id, mood
+        on conflict (user_id, mood) do update set count = user_mood_counts.count + excluded.count
+    ),
+    days as (
+        insert into user_mood_days (user_id, day, mood, count)
+        select user_id, logged_at::date, mood, count(*) from rows group by user_id, logged_at::date, mood
+        on conflict (user_id, day, mood) do update set count = user_mood_days.count + excluded.count
+    )
+    insert into user_artist_counts (user_id, artists, count)
+    select rows.user_id, s.artists, count(*)
+    from rows join newsongs s on s.id = rows.song_id
+    where s.artists is not null
+    group by rows.user_id, s.artists
+    on conflict (user_id, artists) do update set count = user_artist_counts.count + excluded.count;
+$$;
+
+create or replace function clear_user_stats()
+returns void
+language sql
+as $$
+    truncate user_mood_counts, user_mood_days, user_artist_counts;
+$$;
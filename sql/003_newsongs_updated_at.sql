@@ -0,0 +1,23 @@
+-- Watermark column for the song catalog's modified-since refreshes
+-- (SONG_CATALOG_WATERMARK_COLUMN, default updated_at). Without it every catalog
+-- load fails; set SONG_CATALOG_WATERMARK_COLUMN= (empty) to run without it.
+--
+-- The trigger stamps every update, including the update half of an upsert, so
+-- changes made outside the app are picked up too.
+
+alter table newsongs add column if not exists updated_at timestamptz not null default now();
+
+create index if not exists newsongs_updated_at on newsongs (updated_at);
+
+create or replace function newsongs_set_updated_at() returns trigger
+language plpgsql as $$
+begin
+    new.updated_at := now();
+    return new;
+end;
+$$;
+
+drop trigger if exists newsongs_set_updated_at on newsongs;
+create trigger newsongs_set_updated_at
+    before update on newsongs
+    for each row execute function newsongs_set_updated_at();
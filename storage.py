@@ -0,0 +1,712 @@
+# storage.py
+
+import bisect
+import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Optional
+
+import resilience
+import resources
+from metrics import timed
+
+# Which backend get_storage() builds: 'supabase' (default), 'sqlite' or 'memory'.
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "supabase")
+STORAGE_SQLITE_PATH = os.environ.get("STORAGE_SQLITE_PATH", "moodwave.db")
+
+# Supabase calls: overall deadlines (retries included), retries for reads that
+# are safe to repeat, and the circuit breaker. DB_DEADLINES overrides single
+# operations, e.g. "fetch_songs=10,insert_interactions=20".
+DB_READ_DEADLINE_SECONDS = float(os.environ.get("DB_READ_DEADLINE_SECONDS", 3))
+DB_WRITE_DEADLINE_SECONDS = float(os.environ.get("DB_WRITE_DEADLINE_SECONDS", 10))
+DB_DEADLINES = dict((name.strip(), float(seconds)) for name, _, seconds in
+                    (item.partition('=') for item in os.environ.get("DB_DEADLINES", "").split(',') if item.strip()))
+DB_READ_RETRIES = int(os.environ.get("DB_READ_RETRIES", 2))
+DB_BREAKER_FAILURES = int(os.environ.get("DB_BREAKER_FAILURES", 5))
+DB_BREAKER_RESET_SECONDS = float(os.environ.get("DB_BREAKER_RESET_SECONDS", 30))
+
+SONG_FIELDS = ('id', 'song_title', 'artists', 'link', 'mood', 'updated_at')
+USER_FIELDS = ('id', 'name', 'age', 'email', 'username', 'password_hash')
+
+
+class StorageError(Exception):
+    """
+    Raised by a backend when the underlying database rejects or fails an operation.
+    """
+
+
+class StorageOutcomeUnknownError(StorageError):
+    """
+    Raised when a write was sent but no answer came back in time, so it may
+    still have been applied. Writing it again may store it twice.
+    """
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec='microseconds')
+
+
+def rollup_increments(rows: list, artists_by_song: dict) -> tuple:
+    """
+    Counts interaction rows into the three per-user rollups: by mood, by
+    (day, mood) and by artists. Days are the UTC date of the row's timestamp.
+    :return: Counters keyed by (user_id, mood), (user_id, day, mood) and (user_id, artists).
+    """
+    moods, days, artists = Counter(), Counter(), Counter()
+    for row in rows:
+        user_id, mood = row['user_id'], row['detected_mood']
+        moods[user_id, mood] += 1
+        days[user_id, (row.get('timestamp') or _now())[:10], mood] += 1
+        song_artists = artists_by_song.get(row.get('song_id'))
+        if song_artists:
+            artists[user_id, song_artists] += 1
+    return moods, days, artists
+
+
+class StorageBackend(ABC):
+    """
+    The data operations the app needs, for users, songs and interactions.
+    Rows are plain dicts using the column names of the Supabase tables.
+    """
+
+    # --- Users ---
+
+    @abstractmethod
+    def find_user_by_email(self, email: str) -> Optional[dict]:
+        """Returns the user row with this email, or None."""
+
+    @abstractmethod
+    def create_user(self, data: dict) -> dict:
+        """Inserts a user and returns the stored row, including its id."""
+
+    @abstractmethod
+    def update_password_hash(self, user_id, password_hash: str):
+        """Replaces the stored password hash of a user."""
+
+    # --- Songs ---
+
+    @abstractmethod
+    def fetch_songs(self, mood: Optional[str] = None, modified_since: Optional[str] = None,
+                    watermark_column: Optional[str] = None, offset: int = 0, limit: int = 1000) -> list:
+        """
+        Returns one page of songs, optionally of a single mood and/or modified
+        after `modified_since` (compared on `watermark_column`). Pages are ordered
+        by id, or by watermark then id for modified-since queries.
+        """
+
+    @abstractmethod
+    def insert_songs(self, rows: list) -> list:
+        """Inserts songs and returns the stored rows."""
+
+    @abstractmethod
+    def upsert_songs(self, rows: list) -> int:
+        """
+        Inserts songs, or updates the link and mood of the song with the same
+        (song_title, artists). Returns the number of rows written.
+        """
+
+    # --- Interactions ---
+
+    @abstractmethod
+    def insert_interactions(self, rows: list):
+        """Inserts interaction rows into `user_recommendations`."""
+
+    @abstractmethod
+    def fetch_user_history(self, user_id, limit: int) -> list:
+        """
+        Returns the user's latest interactions, newest first, shaped like the
+        Supabase join: timestamp, user_input, detected_mood and a nested
+        `newsongs` dict with song_title, artists and link.
+        """
+
+    @abstractmethod
+    def fetch_recent_song_ids(self, user_id, limit: int) -> list:
+        """Returns the ids of the songs most recently recommended to the user."""
+
+    @abstractmethod
+    def fetch_interactions(self, after_id: int = 0, limit: int = 1000) -> list:
+        """
+        Returns one page of interaction rows (id, user_id, song_id, detected_mood,
+        timestamp) with an id above `after_id`, in id order.
+        """
+
+    @abstractmethod
+    def latest_interaction_id(self) -> int:
+        """
+        Returns the highest interaction id stored so far, or 0 if there is none.
+        """
+
+    # --- User statistics ---
+
+    @abstractmethod
+    def increment_user_stats(self, rows: list):
+        """
+        Adds interaction rows to the per-user rollups: mood counts, per-day mood
+        counts and play counts per artist (looked up through song_id).
+        """
+
+    @abstractmethod
+    def fetch_user_stats(self, user_id, since_day: Optional[str] = None, top_artists: int = 5) -> dict:
+        """
+        Returns a user's rollups: {'moods': {mood: count}, 'days': {day: {mood: count}},
+        'artists': [{'artists': ..., 'count': ...}]}, with days from `since_day`
+        (YYYY-MM-DD) on and the `top_artists` most played artists.
+        """
+
+    @abstractmethod
+    def clear_user_stats(self):
+        """Deletes every rollup row, before a backfill."""
+
+
+class SupabaseBackend(StorageBackend):
+    """
+    Backend for the hosted Supabase project, using the shared client.
+    """
+
+    # Reads that return the same result when repeated, so they may be retried.
+    IDEMPOTENT_OPERATIONS = frozenset({'find_user_by_email', 'fetch_songs', 'fetch_user_history',
+                                       'fetch_recent_song_ids', 'fetch_interactions', 'latest_interaction_id',
+                                       'fetch_user_stats'})
+
+    def __init__(self):
+        # Imported here so the Supabase SDK is only loaded when this backend is used.
+        import httpx
+        from postgrest.exceptions import APIError
+        from supabase_client import get_supabase_client
+        self._api_error = APIError
+        # Network failures and timeouts; an APIError means the database answered.
+        self._transient_errors = (httpx.TransportError,)
+        # Failures after the request went out, which leave a write's outcome unknown.
+        self._unanswered_errors = (resilience.DeadlineExceededError, httpx.ReadTimeout, httpx.RemoteProtocolError)
+        self._client = get_supabase_client()
+        self.breaker = resilience.CircuitBreaker('supabase', DB_BREAKER_FAILURES, DB_BREAKER_RESET_SECONDS)
+        # The 'db.<operation>' span of each operation, so a call does not format the stage name.
+        self._spans = {}
+
+    def _table(self, name: str):
+        return self._client.table(name)
+
+    def _execute(self, operation: str, query) -> list:
+        idempotent = operation in self.IDEMPOTENT_OPERATIONS
+        default_deadline = DB_READ_DEADLINE_SECONDS if idempotent else DB_WRITE_DEADLINE_SECONDS
+        span = self._spans.get(operation)
+        if span is None:
+            span = self._spans.setdefault(operation, timed(f'db.{operation}'))
+        try:
+            with span:
+                return resilience.call(lambda: query.execute().data or [], breaker=self.breaker,
+                                       deadline=DB_DEADLINES.get(operation, default_deadline),
+                                       retries=DB_READ_RETRIES if idempotent else 0,
+                                       retry_on=self._transient_errors)
+        except self._api_error as e:
+            raise StorageError(str(e)) from e
+        except (resilience.CircuitOpenError, resilience.DeadlineExceededError) + self._transient_errors as e:
+            # A write abandoned at its deadline keeps running and may still land.
+            if not idempotent and isinstance(e, self._unanswered_errors):
+                raise StorageOutcomeUnknownError(f"{operation} may or may not have been applied: {e}") from e
+            raise StorageError(f"{operation} failed: {e}") from e
+
+    def find_user_by_email(self, email):
+        rows = self._execute('find_user_by_email', self._table('users').select(
+            'id, name, password_hash').eq('email', email).limit(1))
+        return rows[0] if rows else None
+
+    def create_user(self, data):
+        return self._execute('create_user', self._table('users').insert(data))[0]
+
+    def update_password_hash(self, user_id, password_hash):
+        self._execute('update_password_hash', self._table('users').update(
+            {"password_hash": password_hash}).eq('id', user_id))
+
+    def fetch_songs(self, mood=None, modified_since=None, watermark_column=None, offset=0, limit=1000):
+        # Only the columns the song catalog caches; everything else stays in the database.
+        columns = 'id, song_title, artists, link, mood'
+        if watermark_column:
+            columns += f', {watermark_column}'
+        query = self._table('newsongs').select(columns)
+        if mood is not None:
+            query = query.eq('mood', mood)
+        if modified_since is not None:
+            query = query.gt(watermark_column, modified_since).order(watermark_column)
+        return self._execute('fetch_songs', query.order('id').range(offset, offset + limit - 1))
+
+    def insert_songs(self, rows):
+        return self._execute('insert_songs', self._table('newsongs').insert(rows))
+
+    def upsert_songs(self, rows):
+        # Needs the unique index from sql/001_newsongs_unique_title_artists.sql.
+        # updated_at (sql/003_newsongs_updated_at.sql) is set on every row, so the
+        # catalog's modified-since refresh picks up changed songs.
+        from postgrest.types import ReturnMethod
+        updated_at = _now()
+        self._execute('upsert_songs', self._table('newsongs').upsert(
+            [{'song_title': row.get('song_title'), 'artists': row.get('artists'), 'link': row.get('link'),
+              'mood': row.get('mood'), 'updated_at': updated_at} for row in rows],
+            on_conflict='song_title,artists', returning=ReturnMethod.minimal))
+        return len(rows)
+
+    def insert_interactions(self, rows):
+        self._execute('insert_interactions', self._table('user_recommendations').insert(rows))
+
+    def fetch_user_history(self, user_id, limit):
+        return self._execute('fetch_user_history', self._table('user_recommendations').select(
+            'timestamp, user_input, detected_mood, newsongs(song_title, artists, link)'
+        ).eq('user_id', user_id).order('timestamp', desc=True).limit(limit))
+
+    def fetch_recent_song_ids(self, user_id, limit):
+        rows = self._execute('fetch_recent_song_ids', self._table('user_recommendations').select('song_id').eq(
+            'user_id', user_id).order('timestamp', desc=True).limit(limit))
+        return [row['song_id'] for row in rows]
+
+    def fetch_interactions(self, after_id=0, limit=1000):
+        return self._execute('fetch_interactions', self._table('user_recommendations').select(
+            'id, user_id, song_id, detected_mood, timestamp').gt('id', after_id).order('id').limit(limit))
+
+    def latest_interaction_id(self):
+        rows = self._execute('latest_interaction_id', self._table('user_recommendations').select(
+            'id').order('id', desc=True).limit(1))
+        return rows[0]['id'] if rows else 0
+
+    # The rollup tables and functions are created by sql/002_user_stats_rollups.sql.
+
+    def increment_user_stats(self, rows):
+        # One round trip: the function aggregates the rows and upserts all three rollups.
+        self._execute('increment_user_stats', self._client.rpc('increment_user_stats', {'interactions': [
+            {'user_id': row['user_id'], 'song_id': row.get('song_id'), 'detected_mood': row['detected_mood'],
+             'timestamp': row.get('timestamp')} for row in rows]}))
+
+    def fetch_user_stats(self, user_id, since_day=None, top_artists=5):
+        moods = self._execute('fetch_user_stats', self._table('user_mood_counts').select(
+            'mood, count').eq('user_id', user_id))
+        days_query = self._table('user_mood_days').select('day, mood, count').eq('user_id', user_id)
+        if since_day is not None:
+            days_query = days_query.gte('day', since_day)
+        days = self._execute('fetch_user_stats', days_query.order('day'))
+        artists = self._execute('fetch_user_stats', self._table('user_artist_counts').select(
+            'artists, count').eq('user_id', user_id).order('count', desc=True).limit(top_artists))
+        by_day = {}
+        for row in days:
+            by_day.setdefault(row['day'], {})[row['mood']] = row['count']
+        return {'moods': {row['mood']: row['count'] for row in moods}, 'days': by_day, 'artists': artists}
+
+    def clear_user_stats(self):
+        self._execute('clear_user_stats', self._client.rpc('clear_user_stats', {}))
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT,
+    age INTEGER,
+    email TEXT UNIQUE,
+    username TEXT,
+    password_hash TEXT
+);
+CREATE TABLE IF NOT EXISTS newsongs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    song_title TEXT,
+    artists TEXT,
+    link TEXT,
+    mood TEXT,
+    updated_at TEXT
+);
+CREATE INDEX IF NOT EXISTS newsongs_mood_id ON newsongs (mood, id);
+CREATE UNIQUE INDEX IF NOT EXISTS newsongs_title_artists ON newsongs (song_title, artists);
+CREATE INDEX IF NOT EXISTS newsongs_updated_at ON newsongs (updated_at, id);
+CREATE TABLE IF NOT EXISTS user_recommendations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER,
+    song_id INTEGER,
+    user_input TEXT,
+    detected_mood TEXT,
+    timestamp TEXT
+);
+CREATE INDEX IF NOT EXISTS user_recommendations_user_time ON user_recommendations (user_id, timestamp);
+CREATE TABLE IF NOT EXISTS user_mood_counts (
+    user_id INTEGER,
+    mood TEXT,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (user_id, mood)
+);
+CREATE TABLE IF NOT EXISTS user_mood_days (
+    user_id INTEGER,
+    day TEXT,
+    mood TEXT,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (user_id, day, mood)
+);
+CREATE TABLE IF NOT EXISTS user_artist_counts (
+    user_id INTEGER,
+    artists TEXT,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (user_id, artists)
+);
+CREATE INDEX IF NOT EXISTS user_artist_counts_top ON user_artist_counts (user_id, count);
+"""
+
+
+class SQLiteBackend(StorageBackend):
+    """
+    Local stand-in backed by a SQLite file with the same tables as Supabase.
+    """
+
+    def __init__(self, path: str = STORAGE_SQLITE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        if path != ':memory:':
+            self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(SQLITE_SCHEMA)
+
+    def _query(self, sql: str, params=()) -> list:
+        try:
+            with self._lock:
+                return [dict(row) for row in self._conn.execute(sql, params)]
+        except sqlite3.Error as e:
+            raise StorageError(str(e)) from e
+
+    def _write(self, sql: str, rows: list) -> list:
+        try:
+            with self._lock, self._conn:
+                ids = []
+                for params in rows:
+                    ids.append(self._conn.execute(sql, params).lastrowid)
+                return ids
+        except sqlite3.Error as e:
+            raise StorageError(str(e)) from e
+
+    def _write_many(self, sql: str, rows: list) -> int:
+        try:
+            with self._lock, self._conn:
+                return self._conn.executemany(sql, rows).rowcount
+        except sqlite3.Error as e:
+            raise StorageError(str(e)) from e
+
+    def find_user_by_email(self, email):
+        rows = self._query('SELECT id, name, password_hash FROM users WHERE email = ? LIMIT 1', (email,))
+        return rows[0] if rows else None
+
+    def create_user(self, data):
+        row = {field: data.get(field) for field in USER_FIELDS if field != 'id'}
+        row['id'] = self._write(
+            'INSERT INTO users (name, age, email, username, password_hash) '
+            'VALUES (:name, :age, :email, :username, :password_hash)', [row])[0]
+        return row
+
+    def update_password_hash(self, user_id, password_hash):
+        self._write('UPDATE users SET password_hash = ? WHERE id = ?', [(password_hash, user_id)])
+
+    def fetch_songs(self, mood=None, modified_since=None, watermark_column=None, offset=0, limit=1000):
+        clauses, params = [], []
+        if mood is not None:
+            clauses.append('mood = ?')
+            params.append(mood)
+        order = 'id'
+        if modified_since is not None:
+            # Only updated_at exists locally, whatever the Supabase column is called.
+            clauses.append('updated_at > ?')
+            params.append(modified_since)
+            order = 'updated_at, id'
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        rows = self._query(
+            f'SELECT id, song_title, artists, link, mood, updated_at FROM newsongs {where} '
+            f'ORDER BY {order} LIMIT ? OFFSET ?', (*params, limit, offset))
+        if watermark_column and watermark_column != 'updated_at':
+            for row in rows:
+                row[watermark_column] = row['updated_at']
+        return rows
+
+    def insert_songs(self, rows):
+        stored = []
+        for row in rows:
+            stored.append({field: row.get(field) for field in SONG_FIELDS if field != 'id'})
+            stored[-1]['updated_at'] = stored[-1]['updated_at'] or _now()
+        ids = self._write(
+            'INSERT INTO newsongs (song_title, artists, link, mood, updated_at) '
+            'VALUES (:song_title, :artists, :link, :mood, :updated_at)', stored)
+        for row, song_id in zip(stored, ids):
+            row['id'] = song_id
+        return stored
+
+    def upsert_songs(self, rows):
+        updated_at = _now()
+        return self._write_many(
+            'INSERT INTO newsongs (song_title, artists, link, mood, updated_at) '
+            'VALUES (:song_title, :artists, :link, :mood, :updated_at) '
+            'ON CONFLICT (song_title, artists) DO UPDATE SET '
+            'link = excluded.link, mood = excluded.mood, updated_at = excluded.updated_at',
+            [{'song_title': row.get('song_title'), 'artists': row.get('artists'), 'link': row.get('link'),
+              'mood': row.get('mood'), 'updated_at': updated_at} for row in rows])
+
+    def insert_interactions(self, rows):
+        self._write(
+            'INSERT INTO user_recommendations (user_id, song_id, user_input, detected_mood, timestamp) '
+            'VALUES (:user_id, :song_id, :user_input, :detected_mood, :timestamp)',
+            [{'timestamp': _now(), **row} for row in rows])
+
+    def fetch_user_history(self, user_id, limit):
+        rows = self._query(
+            'SELECT r.timestamp, r.user_input, r.detected_mood, s.id AS song_id, s.song_title, s.artists, s.link '
+            'FROM user_recommendations r LEFT JOIN newsongs s ON s.id = r.song_id '
+            'WHERE r.user_id = ? ORDER BY r.timestamp DESC LIMIT ?', (user_id, limit))
+        return [{
+            'timestamp': row['timestamp'],
+            'user_input': row['user_input'],
+            'detected_mood': row['detected_mood'],
+            'newsongs': {'song_title': row['song_title'], 'artists': row['artists'], 'link': row['link']}
+            if row['song_id'] is not None else None,
+        } for row in rows]
+
+    def fetch_recent_song_ids(self, user_id, limit):
+        rows = self._query('SELECT song_id FROM user_recommendations WHERE user_id = ? '
+                           'ORDER BY timestamp DESC LIMIT ?', (user_id, limit))
+        return [row['song_id'] for row in rows]
+
+    def fetch_interactions(self, after_id=0, limit=1000):
+        return self._query('SELECT id, user_id, song_id, detected_mood, timestamp FROM user_recommendations '
+                           'WHERE id > ? ORDER BY id LIMIT ?', (after_id, limit))
+
+    def latest_interaction_id(self):
+        return self._query('SELECT COALESCE(MAX(id), 0) AS id FROM user_recommendations')[0]['id']
+
+    def increment_user_stats(self, rows):
+        song_ids = list({row['song_id'] for row in rows if row.get('song_id') is not None})
+        try:
+            with self._lock, self._conn:
+                artists_by_song = {}
+                # Chunked to stay under SQLite's limit on bound parameters.
+                for start in range(0, len(song_ids), 500):
+                    chunk = song_ids[start:start + 500]
+                    artists_by_song.update(self._conn.execute(
+                        f"SELECT id, artists FROM newsongs WHERE id IN ({','.join('?' * len(chunk))})", chunk))
+                moods, days, artists = rollup_increments(rows, artists_by_song)
+                self._conn.executemany(
+                    'INSERT INTO user_mood_counts (user_id, mood, count) VALUES (?, ?, ?) '
+                    'ON CONFLICT (user_id, mood) DO UPDATE SET count = count + excluded.count',
+                    [(*key, count) for key, count in moods.items()])
+                self._conn.executemany(
+                    'INSERT INTO user_mood_days (user_id, day, mood, count) VALUES (?, ?, ?, ?) '
+                    'ON CONFLICT (user_id, day, mood) DO UPDATE SET count = count + excluded.count',
+                    [(*key, count) for key, count in days.items()])
+                self._conn.executemany(
+                    'INSERT INTO user_artist_counts (user_id, artists, count) VALUES (?, ?, ?) '
+                    'ON CONFLICT (user_id, artists) DO UPDATE SET count = count + excluded.count',
+                    [(*key, count) for key, count in artists.items()])
+        except sqlite3.Error as e:
+            raise StorageError(str(e)) from e
+
+    def fetch_user_stats(self, user_id, since_day=None, top_artists=5):
+        moods = self._query('SELECT mood, count FROM user_mood_counts WHERE user_id = ?', (user_id,))
+        days = self._query('SELECT day, mood, count FROM user_mood_days WHERE user_id = ? AND day >= ? '
+                           'ORDER BY day', (user_id, since_day or ''))
+        artists = self._query('SELECT artists, count FROM user_artist_counts WHERE user_id = ? '
+                              'ORDER BY count DESC LIMIT ?', (user_id, top_artists))
+        by_day = {}
+        for row in days:
+            by_day.setdefault(row['day'], {})[row['mood']] = row['count']
+        return {'moods': {row['mood']: row['count'] for row in moods}, 'days': by_day, 'artists': artists}
+
+    def clear_user_stats(self):
+        try:
+            with self._lock, self._conn:
+                for table in ('user_mood_counts', 'user_mood_days', 'user_artist_counts'):
+                    self._conn.execute(f'DELETE FROM {table}')
+        except sqlite3.Error as e:
+            raise StorageError(str(e)) from e
+
+
+class InMemoryBackend(StorageBackend):
+    """
+    Process-local stand-in that keeps every table in Python structures.
+    Useful for benchmarks and development; nothing is persisted.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._users = {}
+        self._users_by_email = {}
+        self._songs = {}
+        self._song_ids_by_mood = {}
+        self._song_ids_by_key = {}
+        self._interactions = []
+        self._interactions_by_user = {}
+        self._user_stats = {}
+        self._next_user_id = 1
+        self._next_song_id = 1
+
+    def find_user_by_email(self, email):
+        with self._lock:
+            user = self._users_by_email.get(email)
+            return {'id': user['id'], 'name': user['name'], 'password_hash': user['password_hash']} if user else None
+
+    def create_user(self, data):
+        with self._lock:
+            if data.get('email') in self._users_by_email:
+                raise StorageError(f"A user with email {data['email']} already exists.")
+            user = {field: data.get(field) for field in USER_FIELDS}
+            user['id'] = self._next_user_id
+            self._next_user_id += 1
+            self._users[user['id']] = user
+            self._users_by_email[user['email']] = user
+            return dict(user)
+
+    def update_password_hash(self, user_id, password_hash):
+        with self._lock:
+            if user_id in self._users:
+                self._users[user_id]['password_hash'] = password_hash
+
+    def fetch_songs(self, mood=None, modified_since=None, watermark_column=None, offset=0, limit=1000):
+        with self._lock:
+            if modified_since is None:
+                # Song ids only grow, so the per-mood id lists are already in id order.
+                if mood is None:
+                    ids = list(self._songs)[offset:offset + limit]
+                else:
+                    ids = self._song_ids_by_mood.get(mood, [])[offset:offset + limit]
+                songs = [self._songs[song_id] for song_id in ids]
+            else:
+                songs = sorted((song for song in self._songs.values()
+                                if song['updated_at'] > modified_since and mood in (None, song['mood'])),
+                               key=lambda song: (song['updated_at'], song['id']))[offset:offset + limit]
+            rows = [dict(song) for song in songs]
+        if watermark_column and watermark_column != 'updated_at':
+            for row in rows:
+                row[watermark_column] = row['updated_at']
+        return rows
+
+    def _insert_song(self, row: dict) -> dict:
+        song = {field: row.get(field) for field in SONG_FIELDS}
+        song['id'] = self._next_song_id
+        song['updated_at'] = song['updated_at'] or _now()
+        self._next_song_id += 1
+        self._songs[song['id']] = song
+        self._song_ids_by_mood.setdefault(song['mood'], []).append(song['id'])
+        self._song_ids_by_key.setdefault((song['song_title'], song['artists']), song['id'])
+        return song
+
+    def insert_songs(self, rows):
+        with self._lock:
+            return [dict(self._insert_song(row)) for row in rows]
+
+    def upsert_songs(self, rows):
+        updated_at = _now()
+        with self._lock:
+            for row in rows:
+                song_id = self._song_ids_by_key.get((row.get('song_title'), row.get('artists')))
+                if song_id is None:
+                    self._insert_song(dict(row, updated_at=updated_at))
+                    continue
+                song = self._songs[song_id]
+                if song['mood'] != row.get('mood'):
+                    self._song_ids_by_mood[song['mood']].remove(song_id)
+                    bisect.insort(self._song_ids_by_mood.setdefault(row.get('mood'), []), song_id)
+                song.update(link=row.get('link'), mood=row.get('mood'), updated_at=updated_at)
+        return len(rows)
+
+    def insert_interactions(self, rows):
+        with self._lock:
+            for row in rows:
+                stored = {'timestamp': _now(), **row, 'id': len(self._interactions) + 1}
+                self._interactions.append(stored)
+                self._interactions_by_user.setdefault(row['user_id'], []).append(stored)
+
+    def _latest(self, user_id, limit):
+        rows = self._interactions_by_user.get(user_id, [])
+        return sorted(rows, key=lambda row: row['timestamp'], reverse=True)[:limit]
+
+    def fetch_user_history(self, user_id, limit):
+        with self._lock:
+            history = []
+            for row in self._latest(user_id, limit):
+                song = self._songs.get(row['song_id'])
+                history.append({
+                    'timestamp': row['timestamp'],
+                    'user_input': row['user_input'],
+                    'detected_mood': row['detected_mood'],
+                    'newsongs': {'song_title': song['song_title'], 'artists': song['artists'], 'link': song['link']}
+                    if song else None,
+                })
+            return history
+
+    def fetch_recent_song_ids(self, user_id, limit):
+        with self._lock:
+            return [row['song_id'] for row in self._latest(user_id, limit)]
+
+    def fetch_interactions(self, after_id=0, limit=1000):
+        # Ids are positions in self._interactions, starting at 1.
+        with self._lock:
+            return [{field: row.get(field) for field in ('id', 'user_id', 'song_id', 'detected_mood', 'timestamp')}
+                    for row in self._interactions[after_id:after_id + limit]]
+
+    def latest_interaction_id(self):
+        with self._lock:
+            return len(self._interactions)
+
+    def increment_user_stats(self, rows):
+        with self._lock:
+            artists_by_song = {row.get('song_id'): self._songs[row['song_id']]['artists']
+                               for row in rows if row.get('song_id') in self._songs}
+            moods, days, artists = rollup_increments(rows, artists_by_song)
+            for (user_id, mood), count in moods.items():
+                self._stats_of(user_id)['moods'][mood] += count
+            for (user_id, day, mood), count in days.items():
+                self._stats_of(user_id)['days'].setdefault(day, Counter())[mood] += count
+            for (user_id, song_artists), count in artists.items():
+                self._stats_of(user_id)['artists'][song_artists] += count
+
+    def _stats_of(self, user_id) -> dict:
+        return self._user_stats.setdefault(user_id, {'moods': Counter(), 'days': {}, 'artists': Counter()})
+
+    def fetch_user_stats(self, user_id, since_day=None, top_artists=5):
+        with self._lock:
+            stats = self._user_stats.get(user_id) or {'moods': Counter(), 'days': {}, 'artists': Counter()}
+            return {
+                'moods': dict(stats['moods']),
+                'days': {day: dict(counts) for day, counts in sorted(stats['days'].items())
+                         if since_day is None or day >= since_day},
+                'artists': [{'artists': name, 'count': count}
+                            for name, count in stats['artists'].most_common(top_artists)],
+            }
+
+    def clear_user_stats(self):
+        with self._lock:
+            self._user_stats.clear()
+
+
+BACKENDS = {
+    'supabase': SupabaseBackend,
+    'sqlite': SQLiteBackend,
+    'memory': InMemoryBackend,
+}
+
+def create_storage(name: str = STORAGE_BACKEND) -> StorageBackend:
+    """
+    Builds a backend by its configured name.
+    """
+    try:
+        backend = BACKENDS[name]
+    except KeyError:
+        raise ValueError(f"Unknown storage backend '{name}'. Use one of {sorted(BACKENDS)}.")
+    return backend()
+
+
+def get_storage() -> StorageBackend:
+    """
+    Returns the process-wide storage backend selected by STORAGE_BACKEND,
+    creating it on first use.
+    """
+    return resources.get('storage')
+
+
+def set_storage(backend: StorageBackend):
+    """
+    Replaces the process-wide backend, e.g. with a seeded in-memory one for benchmarks.
+    """
+    resources.replace('storage', backend)
+
+
+resources.register('storage', create_storage)
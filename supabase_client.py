@@ -1,21 +1,105 @@
 import os
-from dotenv import load_dotenv
-from supabase import create_client, Client
+import httpx
 
-# Load environment variables
-load_dotenv()
-url: str = os.environ.get("SUPABASE_URL")
-key: str = os.environ.get("SUPABASE_KEY")
+import resources
 
-def get_supabase_client() -> Client:
+# Keep-alive connection pool shared by every Supabase request in the process.
+POOL_MAX_CONNECTIONS = int(os.environ.get("SUPABASE_POOL_MAX_CONNECTIONS", 20))
+POOL_MAX_KEEPALIVE = int(os.environ.get("SUPABASE_POOL_MAX_KEEPALIVE", 10))
+POOL_KEEPALIVE_SECONDS = float(os.environ.get("SUPABASE_POOL_KEEPALIVE_SECONDS", 30))
+CONNECT_TIMEOUT_SECONDS = float(os.environ.get("SUPABASE_CONNECT_TIMEOUT", 5))
+READ_TIMEOUT_SECONDS = float(os.environ.get("SUPABASE_READ_TIMEOUT", 10))
+
+
+class _CountingTransport(httpx.HTTPTransport):
     """
-    Initializes and returns a Supabase client.
+    HTTP transport that counts requests and newly opened connections, so pool
+    reuse can be reported.
     """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.requests = 0
+        self.connections_opened = 0
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        request.extensions = {**request.extensions, "trace": self._trace}
+        return super().handle_request(request)
+
+    def _trace(self, event_name, info):
+        if event_name == "connection.connect_tcp.complete":
+            self.connections_opened += 1
+
+    def open_connections(self) -> int:
+        pool = getattr(self, "_pool", None)
+        return len(pool.connections) if pool is not None else 0
+
+
+_transport = None
+
+
+def _create_http_client() -> httpx.Client:
+    global _transport
+    _transport = _CountingTransport(
+        limits=httpx.Limits(
+            max_connections=POOL_MAX_CONNECTIONS,
+            max_keepalive_connections=POOL_MAX_KEEPALIVE,
+            keepalive_expiry=POOL_KEEPALIVE_SECONDS,
+        ),
+    )
+    return httpx.Client(
+        transport=_transport,
+        timeout=httpx.Timeout(READ_TIMEOUT_SECONDS, connect=CONNECT_TIMEOUT_SECONDS),
+        follow_redirects=True,
+    )
+
+
+def _create_client():
+    # The Supabase SDK is slow to import, so it is only loaded once a client is needed.
+    from supabase import create_client, ClientOptions
+
+    resources.load_environment()
+    url = os.environ.get("SUPABASE_URL")
+    key = os.environ.get("SUPABASE_KEY")
     if not url or not key:
         raise ValueError("Supabase URL and Key must be set in the .env file.")
     try:
-        return create_client(url, key)
+        return create_client(url, key, options=ClientOptions(httpx_client=_create_http_client()))
     except Exception as e:
         raise ConnectionError(f"Error creating Supabase client: {e}")
 
-supabase = get_supabase_client()
\ No newline at end of file
+
+resources.register('supabase', _create_client)
+
+
+def get_supabase_client():
+    """
+    Returns the process-wide Supabase client, creating it on first use.
+    All services share it, and with it one pooled HTTP connection set.
+    """
+    return resources.get('supabase')
+
+
+def pool_stats() -> dict:
+    """
+    Reports how many requests were sent, how many connections had to be opened
+    for them and how many are open right now.
+    """
+    if _transport is None:
+        return {"requests": 0, "connections_opened": 0, "reused": 0, "open_connections": 0}
+    requests, opened = _transport.requests, _transport.connections_opened
+    return {
+        "requests": requests,
+        "connections_opened": opened,
+        "reused": max(requests - opened, 0),
+        "open_connections": _transport.open_connections(),
+    }
+
+
+def __getattr__(name):
+    # Keeps `from supabase_client import supabase` working without creating the
+    # client at import time of this module.
+    if name == "supabase":
+        return get_supabase_client()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
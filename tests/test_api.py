@@ -0,0 +1,58 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from starlette.testclient import TestClient
+
+import api
+import user_logger
+from storage import InMemoryBackend, StorageError, set_storage
+
+
+class UnavailableBackend(InMemoryBackend):
+    def fetch_user_history(self, user_id, limit):
+        raise StorageError("connection refused")
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(api, 'API_ANALYSIS_PROCESSES', 0)
+    with TestClient(api.app) as client:
+        yield client
+
+
+def test_history_returns_503_when_storage_fails(client):
+    set_storage(UnavailableBackend())
+    user_logger.invalidate_user_history(42)
+    response = client.get('/history/42')
+    assert response.status_code == 503
+    assert 'error' in response.json()
+
+
+def test_user_id_must_be_positive(client):
+    set_storage(InMemoryBackend())
+    assert client.get('/history/0').status_code == 400
+    assert client.post('/recommend', json={'text': 'a calm evening', 'user_id': 0}).status_code == 400
+
+
+def test_rank_computes_the_query_vector_on_the_analysis_executor(client):
+    class RecordingExecutor(ThreadPoolExecutor):
+        def __init__(self):
+            super().__init__(max_workers=1)
+            self.submitted = []
+
+        def submit(self, fn, *args, **kwargs):
+            self.submitted.append(fn.__name__)
+            return super().submit(fn, *args, **kwargs)
+
+    for executor in set(api._executors.values()):
+        executor.shutdown()
+    # Shut down by the app's lifespan when the client closes.
+    analysis, io = RecordingExecutor(), RecordingExecutor()
+    api._executors.update(analysis=analysis, io=io)
+    set_storage(InMemoryBackend())
+
+    response = client.post('/rank', json={'text': 'a quiet grey afternoon', 'k': 3})
+
+    assert response.status_code == 200
+    assert analysis.submitted == ['query_vector']
+    assert io.submitted == ['get_ranked_songs']
@@ -0,0 +1,44 @@
+import pytest
+
+import classify
+
+
+def test_count_records_cuts_partial_csv_row(tmp_path):
+    path = tmp_path / 'out.csv'
+    path.write_bytes(b'text,mood\r\na,happy\r\n"two\nlines",sad\r\n"partial\nrow')
+    assert classify.count_records(str(path), 'csv') == 2
+    assert path.read_bytes() == b'text,mood\r\na,happy\r\n"two\nlines",sad\r\n'
+
+
+def test_count_records_cuts_partial_jsonl_line(tmp_path):
+    path = tmp_path / 'out.jsonl'
+    path.write_bytes(b'{"text": "a \\"quoted\\" word"}\n{"text": "cut')
+    assert classify.count_records(str(path), 'jsonl') == 1
+    assert path.read_bytes() == b'{"text": "a \\"quoted\\" word"}\n'
+
+
+def test_tsv_is_read_and_written_with_tabs(tmp_path):
+    source = tmp_path / 'in.tsv'
+    source.write_text('id\ttext\n1\tI am so angry, it is unfair\n2\tfeeling calm, peaceful\n', encoding='utf-8')
+    target = tmp_path / 'out.tsv'
+
+    totals = classify.classify_file(str(source), str(target), workers=1)
+
+    assert totals['classified'] == 2
+    assert target.read_text(encoding='utf-8').splitlines() == [
+        'id\ttext\tmood', '1\tI am so angry, it is unfair\tangry', '2\tfeeling calm, peaceful\tcalm']
+
+
+@pytest.mark.parametrize('name, content', [
+    ('in.csv', 'id,message\n1,I am so angry\n'),
+    ('in.jsonl', '{"id": 1, "message": "I am so angry"}\n'),
+])
+def test_missing_text_field_fails_before_writing(tmp_path, name, content):
+    source = tmp_path / name
+    source.write_text(content, encoding='utf-8')
+    target = tmp_path / ('out' + source.suffix)
+    target.write_text('kept', encoding='utf-8')
+
+    with pytest.raises(ValueError, match="no 'text' field"):
+        classify.classify_file(str(source), str(target), workers=1)
+    assert target.read_text(encoding='utf-8') == 'kept'
@@ -0,0 +1,18 @@
+import pytest
+from textblob import TextBlob
+
+import emotion_analyzer
+
+
+@pytest.mark.parametrize('text', ['meh :-D', 'I feel GREAT :D', 'so  sad\n\nbut ok :(', '  WOW  :)  '])
+def test_cached_polarity_matches_textblob(text):
+    emotion_analyzer._normalized_polarity.cache_clear()
+    assert emotion_analyzer._polarity(text) == TextBlob(text).sentiment.polarity
+
+
+def test_whitespace_variants_share_a_cache_entry():
+    emotion_analyzer._normalized_polarity.cache_clear()
+    emotion_analyzer._polarity('a quiet day at home')
+    emotion_analyzer._polarity(' a  quiet\nday at home ')
+    info = emotion_analyzer.polarity_cache_info()
+    assert (info.hits, info.misses) == (1, 1)
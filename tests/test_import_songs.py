@@ -0,0 +1,18 @@
+from import_songs import SongImporter
+from storage import InMemoryBackend
+
+
+def test_rows_without_a_valid_link_are_invalid_and_keep_the_stored_link():
+    backend = InMemoryBackend()
+    SongImporter(backend).run([{'song_title': 'Song', 'artists': 'Artist', 'link': 'https://example.com/1',
+                                'mood': 'happy'}])
+
+    counts = SongImporter(backend).run([
+        {'song_title': 'Song', 'artists': 'Artist', 'mood': 'sad'},
+        {'song_title': 'Other', 'artists': 'Artist', 'link': ' ', 'mood': 'sad'},
+        {'song_title': 'Third', 'artists': 'Artist', 'link': 'ftp://example.com/3', 'mood': 'sad'},
+    ])
+
+    assert (counts['invalid'], counts['written']) == (3, 0)
+    songs = backend.fetch_songs('happy')
+    assert [(song['song_title'], song['link']) for song in songs] == [('Song', 'https://example.com/1')]
@@ -0,0 +1,68 @@
+import metrics
+
+
+def test_append_racing_a_fold_is_kept():
+    # The interleaving of a recorder and another thread's fold: the recorder has
+    # read the buffer, the fold runs, then the recorder appends to what it read.
+    hist = metrics.Histogram('test.race')
+    hist.observe(0.002)
+    pending = hist._pending
+    hist._fold()
+    pending.append(0.001)
+    pending.append(-0.003)
+
+    _, total, count, errors = hist.snapshot()
+    assert (count, errors) == (3, 1)
+    assert abs(total - 0.006) < 1e-9
+
+
+def test_timed_records_count_and_errors():
+    metrics.reset()
+    with metrics.timed('test.timed'):
+        pass
+    try:
+        with metrics.timed('test.timed'):
+            raise ValueError
+    except ValueError:
+        pass
+    row, = [row for row in metrics.summary() if row['stage'] == 'test.timed']
+    assert (row['count'], row['errors']) == (2, 1)
+
+
+def test_spans_nest_and_are_shared_between_threads():
+    import threading
+
+    metrics.reset()
+    inside = threading.Event()
+    leave = threading.Event()
+
+    def hold_open():
+        with metrics.timed('test.shared'):
+            inside.set()
+            leave.wait(5)
+
+    thread = threading.Thread(target=hold_open)
+    thread.start()
+    assert inside.wait(5)
+    with metrics.timed('test.shared'):
+        with metrics.timed('test.shared'):
+            pass
+    leave.set()
+    thread.join(5)
+
+    assert metrics.timed('test.shared') is metrics.timed('test.shared')
+    _, total, count, errors = metrics.histogram('test.shared').snapshot()
+    assert (count, errors) == (3, 0)
+    assert total > 0
+
+
+def test_reset_keeps_decorated_functions_recording():
+    @metrics.timed('test.decorated')
+    def decorated():
+        pass
+
+    decorated()
+    metrics.reset()
+    decorated()
+    row, = [row for row in metrics.summary() if row['stage'] == 'test.decorated']
+    assert row['count'] == 1
@@ -0,0 +1,84 @@
+import time
+
+import pytest
+
+import resilience
+from resilience import CircuitBreaker, CircuitOpenError, DeadlineExceededError
+
+
+def failing(error=ConnectionError):
+    def fn():
+        raise error("unreachable")
+    return fn
+
+
+def open_breaker(reset_seconds=0.05):
+    breaker = CircuitBreaker('test', failure_threshold=1, reset_seconds=reset_seconds)
+    with pytest.raises(ConnectionError):
+        resilience.call(failing(), breaker=breaker, retry_on=(ConnectionError,))
+    assert breaker.state == CircuitBreaker.OPEN
+    return breaker
+
+
+def test_half_open_breaker_lets_a_single_trial_through():
+    breaker = open_breaker()
+    assert not breaker.allow()
+    time.sleep(0.06)
+
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow()
+
+
+def test_failed_trial_opens_the_breaker_again():
+    breaker = open_breaker()
+    time.sleep(0.06)
+
+    with pytest.raises(ConnectionError):
+        resilience.call(failing(), breaker=breaker, retry_on=(ConnectionError,))
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        resilience.call(lambda: 'not called', breaker=breaker)
+    assert breaker.stats()['opened'] == 2
+
+
+def test_error_outside_retry_on_is_not_a_failure():
+    # E.g. an APIError: the service answered, it only rejected the request.
+    breaker = CircuitBreaker('test', failure_threshold=1)
+    calls = []
+
+    def rejected():
+        calls.append(1)
+        raise ValueError("rejected")
+
+    with pytest.raises(ValueError):
+        resilience.call(rejected, breaker=breaker, retries=3, retry_on=(ConnectionError,))
+    assert len(calls) == 1
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.stats()['failures'] == 0
+
+
+def test_retries_stop_inside_the_deadline():
+    calls = []
+
+    def unreachable():
+        calls.append(time.monotonic())
+        raise ConnectionError("unreachable")
+
+    started = time.monotonic()
+    with pytest.raises(ConnectionError):
+        resilience.call(unreachable, deadline=0.3, retries=100, retry_on=(ConnectionError,),
+                        base_delay=0.05, max_delay=0.05)
+    assert all(attempt - started < 0.3 for attempt in calls)
+    assert time.monotonic() - started < 0.35
+    assert 1 < len(calls) < 100
+
+
+def test_deadline_exceeded_is_raised_on_time():
+    started = time.monotonic()
+    with pytest.raises(DeadlineExceededError):
+        resilience.call(lambda: time.sleep(1), deadline=0.1)
+    assert 0.1 <= time.monotonic() - started < 0.3
@@ -0,0 +1,63 @@
+import pytest
+
+import song_recommender
+from storage import InMemoryBackend, set_storage
+
+
+def song(index, mood='happy'):
+    return {'song_title': f'Song {index}', 'artists': 'Artist', 'link': f'https://example.com/{index}', 'mood': mood}
+
+
+@pytest.fixture
+def rotation():
+    backend = InMemoryBackend()
+    backend.insert_songs([song(index) for index in range(10)])
+    set_storage(backend)
+    catalog = song_recommender.SongCatalog(refresh_interval=0, watermark_column='updated_at')
+    rotation = song_recommender.SongRotation(catalog, history_seed=0)
+    rotation.backend = backend
+    yield rotation
+    catalog.close()
+
+
+def deal(rotation, count):
+    return [rotation.next_song(1, 'happy')['id'] for _ in range(count)]
+
+
+def test_reload_with_unchanged_contents_keeps_the_deck(rotation):
+    for _ in range(50):
+        rotation.forget(1)
+        first = deal(rotation, 5)
+        rotation.catalog._load_partition('happy')
+        second = deal(rotation, 5)
+        assert len(set(first + second)) == 10
+
+
+def test_no_repeats_across_a_mood_move_and_an_appended_song(rotation):
+    for trial in range(50):
+        rotation.forget(1)
+        dealt = deal(rotation, 4)
+        rotation.catalog._load_partition('happy')
+        dealt += deal(rotation, 2)
+
+        # Move a song that has not been dealt out of the partition: positions
+        # change, so the deck is rebuilt from the songs dealt so far.
+        moved = next(song_id for song_id in rotation.catalog.get_partition('happy').ids if song_id not in dealt)
+        moved_song = rotation.backend._songs[moved]
+        rotation.backend.upsert_songs([dict(moved_song, mood='sad')])
+        rotation.catalog.refresh()
+        assert moved not in rotation.catalog.get_partition('happy').positions
+        dealt += deal(rotation, 1)
+
+        # An appended song joins the undealt part of the deck.
+        rotation.backend.upsert_songs([song(f'new-{trial}')])
+        rotation.catalog.refresh()
+        remaining = len(rotation.catalog.get_partition('happy')) - len(dealt)
+        dealt += deal(rotation, remaining)
+
+        assert len(dealt) == len(set(dealt))
+        assert set(dealt) == set(rotation.catalog.get_partition('happy').ids)
+
+        # Reset for the next trial: move the song back.
+        rotation.backend.upsert_songs([dict(moved_song, mood='happy')])
+        rotation.catalog.refresh()
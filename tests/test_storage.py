@@ -0,0 +1,30 @@
+import time
+
+import pytest
+
+import storage
+import supabase_client
+
+
+class SlowQuery:
+    def execute(self):
+        time.sleep(0.2)
+        return self
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    monkeypatch.setattr(supabase_client, 'get_supabase_client', lambda: None)
+    monkeypatch.setattr(storage, 'DB_DEADLINES', {'insert_interactions': 0.05, 'fetch_songs': 0.05})
+    return storage.SupabaseBackend()
+
+
+def test_write_past_its_deadline_has_an_unknown_outcome(backend):
+    with pytest.raises(storage.StorageOutcomeUnknownError):
+        backend._execute('insert_interactions', SlowQuery())
+
+
+def test_read_past_its_deadline_simply_failed(backend):
+    with pytest.raises(storage.StorageError) as raised:
+        backend._execute('fetch_songs', SlowQuery())
+    assert not isinstance(raised.value, storage.StorageOutcomeUnknownError)
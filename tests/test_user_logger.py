@@ -0,0 +1,150 @@
+import threading
+import time
+
+import pytest
+
+import user_logger
+from storage import InMemoryBackend, StorageOutcomeUnknownError, set_storage
+
+SONG = {'id': 1, 'song_title': 'Song 1', 'artists': 'Artist 1', 'link': 'https://example.com/1', 'mood': 'happy'}
+
+
+class GatedBackend(InMemoryBackend):
+    """
+    Holds inserts until released, either before or after storing the rows.
+    """
+
+    def __init__(self, store_first: bool = False):
+        super().__init__()
+        self.store_first = store_first
+        self.entered = threading.Event()
+        self.release = threading.Event()
+
+    def insert_interactions(self, rows):
+        if self.store_first:
+            super().insert_interactions(rows)
+        self.entered.set()
+        self.release.wait(5)
+        if not self.store_first:
+            super().insert_interactions(rows)
+
+
+@pytest.fixture
+def writer(monkeypatch):
+    def install(backend, flush_seconds=0.05):
+        backend.insert_songs([{key: value for key, value in SONG.items() if key != 'id'}])
+        set_storage(backend)
+        writer = user_logger.InteractionWriter(flush_seconds=flush_seconds)
+        monkeypatch.setattr(user_logger, 'interaction_writer', writer)
+        monkeypatch.setattr(user_logger, 'USER_STATS_ROLLUPS', False)
+        user_logger.invalidate_user_history(7)
+        return writer
+    yield install
+    user_logger.invalidate_user_history(7)
+
+
+def wait_until_written(writer, count):
+    deadline = time.monotonic() + 5
+    while writer.stats()['written'] < count and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert writer.stats()['written'] == count
+
+
+def test_cold_read_before_flush_includes_queued_record(writer):
+    backend = InMemoryBackend()
+    interactions = writer(backend, flush_seconds=0.5)
+
+    user_logger.log_user_interaction(7, 'first input text here', 'happy', 1, SONG)
+    assert len(user_logger.get_user_history(7)) == 1
+
+    wait_until_written(interactions, 1)
+    assert len(user_logger.get_user_history(7)) == 1
+    user_logger.log_user_interaction(7, 'second input text here', 'sad', 1, SONG)
+    assert len(user_logger.get_user_history(7)) == 2
+    wait_until_written(interactions, 2)
+    user_logger.invalidate_user_history(7)
+    assert [row['Mood'] for row in user_logger.get_user_history(7)] == ['SAD', 'HAPPY']
+
+
+@pytest.mark.parametrize('store_first', [False, True])
+def test_cold_read_during_insert_shows_record_once(writer, store_first):
+    backend = GatedBackend(store_first)
+    interactions = writer(backend)
+
+    user_logger.log_user_interaction(7, 'an in-flight input', 'calm', 1, SONG)
+    assert backend.entered.wait(5)
+    user_logger.invalidate_user_history(7)
+    history = user_logger.get_user_history(7)
+    backend.release.set()
+    wait_until_written(interactions, 1)
+
+    assert [row['Mood'] for row in history] == ['CALM']
+    assert interactions.pending(7) == []
+
+
+def test_record_logged_during_history_query_is_not_lost(writer):
+    class LoggingBackend(InMemoryBackend):
+        def fetch_user_history(self, user_id, limit):
+            rows = super().fetch_user_history(user_id, limit)
+            user_logger.log_user_interaction(7, 'logged while reading', 'angry', 1, SONG)
+            return rows
+
+    interactions = writer(LoggingBackend(), flush_seconds=0.5)
+    user_logger.log_user_interaction(7, 'logged before reading', 'happy', 1, SONG)
+    history = user_logger.get_user_history(7)
+    wait_until_written(interactions, 2)
+
+    assert [row['Mood'] for row in history] == ['ANGRY', 'HAPPY']
+    assert [row['Mood'] for row in user_logger.get_user_history(7)] == ['ANGRY', 'HAPPY']
+
+
+def test_unreadable_spill_line_is_quarantined_and_writer_keeps_running(writer, tmp_path):
+    backend = InMemoryBackend()
+    spill = tmp_path / 'spill.jsonl'
+    spill.write_text('{"user_id": 7, "song_id": 1, "user_input": "spilled", "detected_mood": "sad", '
+                     '"timestamp": "2026-01-01T00:00:00.000000+00:00"}\n{"user_id": 7, "song_')
+    interactions = writer(backend)
+    interactions.spill_file = str(spill)
+
+    user_logger.log_user_interaction(7, 'queued after the crash', 'happy', 1, SONG)
+    wait_until_written(interactions, 2)
+
+    assert interactions._thread.is_alive()
+    assert interactions.stats()['quarantined'] == 1
+    assert (tmp_path / 'spill.jsonl.bad').read_text() == '{"user_id": 7, "song_\n'
+    assert not (tmp_path / 'spill.jsonl.replay').exists()
+
+
+def test_failing_spill_does_not_stop_the_writer(writer, tmp_path):
+    class FailingBackend(InMemoryBackend):
+        def insert_interactions(self, rows):
+            raise OSError("database unreachable")
+
+    interactions = writer(FailingBackend())
+    interactions.spill_file = str(tmp_path / 'missing-directory' / 'spill.jsonl')
+
+    user_logger.log_user_interaction(7, 'cannot be stored', 'happy', 1, SONG)
+    deadline = time.monotonic() + 5
+    while interactions.stats()['failed'] < 1 and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    assert interactions.stats()['failed'] == 1
+    assert interactions._thread.is_alive()
+
+
+def test_insert_with_unknown_outcome_is_not_spilled(writer, tmp_path):
+    class TimingOutBackend(InMemoryBackend):
+        def insert_interactions(self, rows):
+            raise StorageOutcomeUnknownError("insert_interactions may or may not have been applied")
+
+    interactions = writer(TimingOutBackend())
+    interactions.spill_file = str(tmp_path / 'spill.jsonl')
+
+    user_logger.log_user_interaction(7, 'maybe stored', 'happy', 1, SONG)
+    deadline = time.monotonic() + 5
+    while interactions.stats()['unconfirmed'] < 1 and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    assert interactions.stats()['unconfirmed'] == 1
+    assert interactions.stats()['spilled'] == 0
+    assert not (tmp_path / 'spill.jsonl').exists()
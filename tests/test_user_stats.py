@@ -0,0 +1,29 @@
+import user_stats
+from storage import InMemoryBackend, set_storage
+
+
+class ReplayDuringBackfill(InMemoryBackend):
+    """
+    Inserts a spilled, hours-old record right after the backfill reads its cutoff,
+    and counts it in the rollups the way the interaction writer does.
+    """
+
+    def latest_interaction_id(self):
+        latest = super().latest_interaction_id()
+        replayed = [{'user_id': 1, 'song_id': 1, 'user_input': 'replayed', 'detected_mood': 'sad',
+                     'timestamp': '2020-01-01T00:00:00.000000+00:00'}]
+        self.insert_interactions(replayed)
+        self.increment_user_stats(replayed)
+        return latest
+
+
+def test_backfill_does_not_double_count_records_inserted_after_it_starts():
+    backend = ReplayDuringBackfill()
+    backend.insert_songs([{'song_title': 'Song', 'artists': 'Artist', 'link': None, 'mood': 'sad'}])
+    backend.insert_interactions([{'user_id': 1, 'song_id': 1, 'user_input': 'logged', 'detected_mood': 'happy'}])
+    set_storage(backend)
+
+    totals = user_stats.backfill(page_size=1)
+
+    assert totals['counted'] == 1
+    assert backend.fetch_user_stats(1)['moods'] == {'happy': 1, 'sad': 1}
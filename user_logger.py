@@ -1,54 +1,418 @@
 # user_logger.py
 
-from supabase_client import supabase
-import streamlit as st 
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Optional
 
-def log_user_interaction(user_id: int, user_input: str, detected_mood: str, recommended_song_id: int):
+from metrics import timed
+from storage import StorageOutcomeUnknownError, get_storage
+import streamlit as st
+
+# Interactions are written in the background as multi-row inserts. A batch is
+# flushed when it reaches LOG_BATCH_SIZE records or is LOG_FLUSH_SECONDS old.
+LOG_BATCH_SIZE = int(os.environ.get("INTERACTION_LOG_BATCH_SIZE", 50))
+LOG_FLUSH_SECONDS = float(os.environ.get("INTERACTION_LOG_FLUSH_SECONDS", 2.0))
+LOG_QUEUE_SIZE = int(os.environ.get("INTERACTION_LOG_QUEUE_SIZE", 10000))
+# What to do with a new record when the queue is full: 'drop_oldest', 'drop_newest' or 'spill'.
+LOG_OVERFLOW_POLICY = os.environ.get("INTERACTION_LOG_OVERFLOW", "drop_oldest")
+# Optional JSONL file that receives batches while the database is failing or slow;
+# they are replayed once inserts are healthy again. Empty disables spilling.
+LOG_SPILL_FILE = os.environ.get("INTERACTION_LOG_SPILL_FILE", "")
+LOG_SLOW_INSERT_SECONDS = float(os.environ.get("INTERACTION_LOG_SLOW_SECONDS", 5.0))
+LOG_SPILL_COOLDOWN_SECONDS = 30.0
+# Whether each written batch is also added to the per-user mood rollups (see user_stats).
+USER_STATS_ROLLUPS = os.environ.get("USER_STATS_ROLLUPS", "1").lower() in ("1", "true", "yes")
+
+OVERFLOW_POLICIES = ('drop_oldest', 'drop_newest', 'spill')
+
+
+class InteractionWriter:
+    """
+    Queues interaction records and writes them to `user_recommendations` from a
+    background thread, so logging does not wait for a database round trip.
+    """
+
+    def __init__(self, batch_size: int = LOG_BATCH_SIZE, flush_seconds: float = LOG_FLUSH_SECONDS,
+                 queue_size: int = LOG_QUEUE_SIZE, overflow_policy: str = LOG_OVERFLOW_POLICY,
+                 spill_file: str = LOG_SPILL_FILE, slow_insert_seconds: float = LOG_SLOW_INSERT_SECONDS):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy '{overflow_policy}'. Use one of {OVERFLOW_POLICIES}.")
+        if overflow_policy == 'spill' and not spill_file:
+            raise ValueError("The 'spill' overflow policy needs a spill file.")
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.overflow_policy = overflow_policy
+        self.spill_file = spill_file
+        self.slow_insert_seconds = slow_insert_seconds
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._spill_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._spill_until = 0.0
+        self._counts = {'enqueued': 0, 'written': 0, 'inserts': 0, 'dropped': 0, 'spilled': 0, 'failed': 0,
+                        'rollup_failures': 0, 'quarantined': 0, 'writer_errors': 0, 'unconfirmed': 0}
+        # Queued and in-flight records per user, with the details given to submit().
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+
+    def submit(self, record: dict, details=None) -> bool:
+        """
+        Queues a record for writing. Returns False if the record was dropped.
+        :param details: Kept with the record until it is written and returned by pending().
+        """
+        self._ensure_started()
+        # Tracked before it is queued, so the writer cannot finish it first.
+        self._track(record, details)
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            if self.overflow_policy == 'drop_newest':
+                self._forget([record])
+                self._counts['dropped'] += 1
+                return False
+            if self.overflow_policy == 'spill':
+                self._forget([record])
+                self._spill([record])
+                return True
+            try:
+                self._forget([self._queue.get_nowait()])
+                self._counts['dropped'] += 1
+            except queue.Empty:
+                pass
+            try:
+                self._queue.put_nowait(record)
+            except queue.Full:
+                self._forget([record])
+                self._counts['dropped'] += 1
+                return False
+        self._counts['enqueued'] += 1
+        return True
+
+    def pending(self, user_id) -> list:
+        """
+        Returns (record, details) for the user's records that are queued or
+        being written, i.e. that a read from the database may not see yet.
+        Spilled records are not included.
+        """
+        with self._pending_lock:
+            return list(self._pending.get(user_id, ()))
+
+    def _track(self, record: dict, details):
+        with self._pending_lock:
+            self._pending.setdefault(record.get('user_id'), []).append((record, details))
+
+    def _forget(self, records: list):
+        finished = {id(record) for record in records}
+        with self._pending_lock:
+            for user_id in {record.get('user_id') for record in records}:
+                kept = [item for item in self._pending.get(user_id, ()) if id(item[0]) not in finished]
+                if kept:
+                    self._pending[user_id] = kept
+                else:
+                    self._pending.pop(user_id, None)
+
+    def flush(self):
+        """
+        Writes everything that is currently queued, on the calling thread.
+        """
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+            if len(batch) >= self.batch_size:
+                self._write(batch)
+                batch = []
+        if batch:
+            self._write(batch)
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.flush_seconds + self.slow_insert_seconds)
+        self.flush()
+
+    def stats(self) -> dict:
+        return dict(self._counts, queued=self._queue.qsize())
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='interaction-writer', daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = []
+            deadline = None
+            while len(batch) < self.batch_size:
+                timeout = self.flush_seconds if deadline is None else deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_seconds
+                if self._stop.is_set():
+                    break
+            # Nothing may end this thread: it is never restarted, and the queue
+            # would silently fill up and drop every later record.
+            try:
+                if batch:
+                    self._write(batch)
+                elif self.spill_file and time.monotonic() >= self._spill_until:
+                    self._replay_spill()
+            except Exception as e:
+                self._counts['writer_errors'] += 1
+                self._spill_until = time.monotonic() + LOG_SPILL_COOLDOWN_SECONDS
+                print(f"Error in the interaction writer: {e}")
+
+    def _insert(self, batch: list) -> bool:
+        # Returns False if the batch was not written and can be written again later.
+        started = time.monotonic()
+        try:
+            with timed('history.flush'):
+                get_storage().insert_interactions(batch)
+        except StorageOutcomeUnknownError as e:
+            # The insert may still have been applied: spilling and replaying it could log it twice.
+            print(f"Could not confirm that {len(batch)} interactions were logged: {e}")
+            self._counts['unconfirmed'] += len(batch)
+            self._spill_until = time.monotonic() + LOG_SPILL_COOLDOWN_SECONDS
+            return True
+        except Exception as e:
+            print(f"Error logging {len(batch)} interactions: {e}")
+            self._spill_until = time.monotonic() + LOG_SPILL_COOLDOWN_SECONDS
+            return False
+        if time.monotonic() - started > self.slow_insert_seconds:
+            # The database is struggling: park the next batches on disk for a while.
+            self._spill_until = time.monotonic() + LOG_SPILL_COOLDOWN_SECONDS
+        self._counts['inserts'] += 1
+        self._counts['written'] += len(batch)
+        if USER_STATS_ROLLUPS:
+            self._update_rollups(batch)
+        return True
+
+    def _update_rollups(self, batch: list):
+        # The interactions are already stored, so a failure here is only reported;
+        # `python user_stats.py backfill` rebuilds the rollups from the log.
+        try:
+            with timed('history.rollups'):
+                get_storage().increment_user_stats(batch)
+        except Exception as e:
+            self._counts['rollup_failures'] += 1
+            print(f"Error updating mood statistics for {len(batch)} interactions: {e}")
+
+    def _write(self, batch: list):
+        try:
+            with self._write_lock:
+                if self.spill_file and time.monotonic() < self._spill_until:
+                    self._spill_or_fail(batch)
+                elif not self._insert(batch):
+                    if self.spill_file:
+                        self._spill_or_fail(batch)
+                    else:
+                        self._counts['failed'] += len(batch)
+        finally:
+            self._forget(batch)
+
+    def _spill_or_fail(self, records: list):
+        try:
+            self._spill(records)
+        except OSError as e:
+            self._counts['failed'] += len(records)
+            print(f"Could not spill {len(records)} interactions to {self.spill_file}: {e}")
+
+    def _spill(self, records: list):
+        with self._spill_lock:
+            with open(self.spill_file, 'a', encoding='utf-8') as spill:
+                for record in records:
+                    spill.write(json.dumps(record) + '\n')
+        self._counts['spilled'] += len(records)
+
+    def _replay_spill(self):
+        replaying = self.spill_file + '.replay'
+        with self._spill_lock:
+            if not os.path.exists(replaying):
+                if not os.path.exists(self.spill_file):
+                    return
+                os.replace(self.spill_file, replaying)
+        records, corrupt = [], []
+        with open(replaying, encoding='utf-8', errors='replace') as spill:
+            for line in spill:
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # E.g. a line cut short when the process died or the disk filled mid-append.
+                    corrupt.append(line if line.endswith('\n') else line + '\n')
+                    continue
+                if isinstance(record, dict):
+                    records.append(record)
+                else:
+                    corrupt.append(line if line.endswith('\n') else line + '\n')
+        if corrupt:
+            self._quarantine(corrupt)
+        for start in range(0, len(records), self.batch_size):
+            with self._write_lock:
+                if not self._insert(records[start:start + self.batch_size]):
+                    # Put the unwritten records back in the spill file for the next attempt.
+                    self._spill(records[start:])
+                    break
+        os.remove(replaying)
+
+    def _quarantine(self, lines: list):
+        # Kept for inspection next to the spill file instead of blocking every later replay.
+        quarantine = self.spill_file + '.bad'
+        with open(quarantine, 'a', encoding='utf-8') as bad:
+            bad.writelines(lines)
+        self._counts['quarantined'] += len(lines)
+        print(f"Moved {len(lines)} unreadable spilled interactions to {quarantine}.")
+
+
+interaction_writer = InteractionWriter()
+
+
+@timed('history.log')
+def log_user_interaction(user_id: int, user_input: str, detected_mood: str, recommended_song_id: int,
+                         song: Optional[dict] = None) -> bool:
     """
-    Logs a user's interaction and song recommendation to the database.
-    (Omitted for brevity, assume function body is correct)
+    Queues a user's interaction and song recommendation for logging to the database.
+    The record is written in the background as part of a batched insert, and the
+    user's cached history is updated straight away.
+    :param song: The recommended song's details, used to update the cached history.
+    :return: True if the interaction was queued (or spilled to disk), False if it was dropped.
     """
+    data_to_log = {
+        "user_id": user_id,
+        "song_id": recommended_song_id,
+        "user_input": user_input,
+        "detected_mood": detected_mood,
+        # Stamp the record now, not when its batch reaches the database.
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec='microseconds'),
+    }
+    queued = interaction_writer.submit(data_to_log, song)
+    if queued and song is not None:
+        _prepend_history(user_id, _format_history_row(data_to_log, song))
+    else:
+        invalidate_user_history(user_id)
+    return queued
+
+
+# Formatted history per user, most recent first. Written through by
+# log_user_interaction so the history query only runs for cold sessions.
+HISTORY_LIMIT = 5
+HISTORY_CACHE_USERS = int(os.environ.get("USER_HISTORY_CACHE_USERS", 1024))
+_history_cache = OrderedDict()
+_history_lock = threading.Lock()
+
+
+def _format_history_row(item: dict, song_data: Optional[dict]) -> dict:
+    timestamp_str = item['timestamp'].split('.')[0].replace('T', ' ')
+    song_data = song_data if song_data else {'song_title': 'N/A', 'artists': 'N/A', 'link': '#'}
+    return {
+        'Time': timestamp_str,
+        'Input Snippet': item['user_input'][:30] + '...',
+        'Mood': item['detected_mood'].upper(),
+        'Song Title': song_data['song_title'],
+        'Artist': song_data['artists'],
+        'Link': song_data['link']
+    }
+
+
+def _parse_timestamp(value) -> datetime:
+    # The database may format a stored timestamp differently (e.g. fewer fraction digits).
     try:
-        data_to_log = {
-            "user_id": user_id,
-            "song_id": recommended_song_id,
-            "user_input": user_input,
-            "detected_mood": detected_mood
-        }
-        response = supabase.table("user_recommendations").insert(data_to_log).execute()
-        if response.data:
-            st.toast("Interaction logged successfully.", icon="💾")
-    except Exception as e:
-        st.caption(f"Error logging interaction: {e}")
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except (AttributeError, ValueError):
+        return datetime.min.replace(tzinfo=timezone.utc)
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def _merge_pending(stored: list, pending: list) -> list:
+    """
+    Formats the stored history rows together with records that are still queued
+    or being written, most recent first, without counting a record twice.
+    """
+    items = [(_parse_timestamp(item['timestamp']), item, item.get('newsongs')) for item in stored]
+    seen = {(timestamp, item['user_input'], item['detected_mood']) for timestamp, item, _ in items}
+    for record, song in pending:
+        timestamp = _parse_timestamp(record['timestamp'])
+        key = (timestamp, record['user_input'], record['detected_mood'])
+        if key not in seen:
+            seen.add(key)
+            items.append((timestamp, record, song))
+    if pending:
+        items.sort(key=lambda entry: entry[0], reverse=True)
+    return [_format_history_row(item, song) for _, item, song in items[:HISTORY_LIMIT]]
+
+
+def _prepend_history(user_id, row: dict):
+    with _history_lock:
+        history = _history_cache.get(user_id)
+        if history is not None:
+            history.insert(0, row)
+            del history[HISTORY_LIMIT:]
+            _history_cache.move_to_end(user_id)
+
+
+def invalidate_user_history(user_id):
+    """
+    Drops the cached history of a user so the next read queries the database.
+    """
+    with _history_lock:
+        _history_cache.pop(user_id, None)
+
+
+@timed('history.get')
+def read_user_history(user_id) -> list:
+    """
+    Returns the last 5 recommendations for the given user ID. The first call for
+    a user fetches them from the database, joining with the newsongs table.
+    :raises StorageError: If the history cannot be read.
+    """
+    with _history_lock:
+        history = _history_cache.get(user_id)
+        if history is not None:
+            _history_cache.move_to_end(user_id)
+            return list(history)
+    # Unwritten records are read before the query (in case they are written
+    # meanwhile) and again after it (in case they were submitted meanwhile).
+    # A record seen twice, or also returned by the query, is merged once.
+    pending = interaction_writer.pending(user_id)
+    stored = get_storage().fetch_user_history(user_id, HISTORY_LIMIT)
+    with _history_lock:
+        # Under the lock, so a record submitted after this snapshot is
+        # prepended to the cached entry by log_user_interaction instead.
+        history = _merge_pending(stored, pending + interaction_writer.pending(user_id))
+        _history_cache[user_id] = history
+        _history_cache.move_to_end(user_id)
+        while len(_history_cache) > HISTORY_CACHE_USERS:
+            _history_cache.popitem(last=False)
+    return list(history)
 
 
 def get_user_history(user_id):
     """
-    Fetches the last 5 recommendations for the given user ID, joining with the newsongs table.
+    Returns the last 5 recommendations for the given user ID, or an empty list
+    (with an error shown in the app) if they cannot be read.
     """
     try:
-        # FIX: Changed 'songs' to 'newsongs' in the select statement
-        response = supabase.table('user_recommendations').select(
-            'timestamp, user_input, detected_mood, newsongs(song_title, artists, link)' 
-        ).eq('user_id', user_id).order('timestamp', desc=True).limit(5).execute()
-        
-        if response.data:
-            history = []
-            for item in response.data:
-                timestamp_str = item['timestamp'].split('.')[0].replace('T', ' ')
-                # FIX: Use 'newsongs' key for data retrieval
-                song_data = item['newsongs'] if item.get('newsongs') else {'song_title': 'N/A', 'artists': 'N/A', 'link': '#'}
-                
-                history.append({
-                    'Time': timestamp_str,
-                    'Input Snippet': item['user_input'][:30] + '...',
-                    'Mood': item['detected_mood'].upper(),
-                    'Song Title': song_data['song_title'],
-                    'Artist': song_data['artists'],
-                    'Link': song_data['link']
-                })
-            return history
-        return []
+        return read_user_history(user_id)
     except Exception as e:
         st.error(f"Error fetching history: {e}")
-        return []
\ No newline at end of file
+        return []
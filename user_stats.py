@@ -0,0 +1,103 @@
+# user_stats.py
+"""
+Per-user mood statistics, read from rollups that the interaction writer keeps
+up to date on every flush (see user_logger). Reading them is a few keyed
+lookups, whatever the size of `user_recommendations`.
+
+    python user_stats.py backfill     # rebuild the rollups from the logged interactions
+    python user_stats.py show 42      # print a user's statistics
+"""
+
+import argparse
+import json
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+import resources
+
+# Settings are read at import time by the service modules, so .env goes first.
+resources.load_environment()
+
+from storage import get_storage
+
+BACKFILL_PAGE_SIZE = 1000
+PROGRESS_EVERY_SECONDS = 5.0
+
+
+def get_user_mood_stats(user_id, days: int = 30, top_artists: int = 5) -> dict:
+    """
+    Returns the user's mood counts, per-day mood counts for the last `days`
+    days and most played artists, or empty statistics if they cannot be read.
+    """
+    since_day = (datetime.now(timezone.utc) - timedelta(days=days - 1)).date().isoformat()
+    try:
+        return get_storage().fetch_user_stats(user_id, since_day, top_artists)
+    except Exception as e:
+        print(f"An error occurred while reading mood statistics: {e}")
+        return {'moods': {}, 'days': {}, 'artists': []}
+
+
+def backfill(page_size: int = BACKFILL_PAGE_SIZE, progress=None) -> dict:
+    """
+    Rebuilds every rollup from `user_recommendations` in one streaming pass.
+    Only interactions up to the highest id stored when the backfill starts are
+    counted; the writer counts everything inserted later itself, however old its
+    timestamp (e.g. spilled records replayed after an outage). A batch that is
+    being written at that moment can still be counted twice.
+    :return: The number of interactions counted, the last id counted and the seconds taken.
+    """
+    storage = get_storage()
+    started = time.perf_counter()
+    storage.clear_user_stats()
+    # Read after clearing: rows inserted after this id are added by the writer,
+    # whose increments from now on are no longer cleared.
+    last_id = storage.latest_interaction_id()
+    totals = {'counted': 0, 'last_id': last_id}
+    after_id = 0
+    while after_id < last_id:
+        page = storage.fetch_interactions(after_id, min(page_size, last_id - after_id))
+        if not page:
+            break
+        after_id = page[-1]['id']
+        rows = [row for row in page if row['id'] <= last_id]
+        if rows:
+            storage.increment_user_stats(rows)
+        totals['counted'] += len(rows)
+        if progress:
+            progress(totals)
+    totals['seconds'] = time.perf_counter() - started
+    return totals
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Maintain and read per-user mood statistics.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    backfill_parser = commands.add_parser('backfill', help='Rebuild the rollups from the logged interactions.')
+    backfill_parser.add_argument('--page-size', type=int, default=BACKFILL_PAGE_SIZE)
+    show = commands.add_parser('show', help="Print a user's statistics as JSON.")
+    show.add_argument('user_id', type=int)
+    show.add_argument('--days', type=int, default=30)
+    args = parser.parse_args(argv)
+
+    if args.command == 'show':
+        print(json.dumps(get_user_mood_stats(args.user_id, args.days), indent=2))
+        return 0
+    last_report = [time.perf_counter()]
+
+    def report(totals):
+        if time.perf_counter() - last_report[0] >= PROGRESS_EVERY_SECONDS:
+            last_report[0] = time.perf_counter()
+            print(f"{totals['counted']} interactions counted", file=sys.stderr)
+
+    try:
+        totals = backfill(args.page_size, report)
+    except Exception as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    print(f"Counted {totals['counted']} interactions up to id {totals['last_id']} in {totals['seconds']:.1f}s.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())